@@ -0,0 +1,222 @@
+"""
+assisted_decoding.py
+
+Compares generate_idea with the target model alone against assisted decoding
+(ASSISTED_DECODING=1: distilgpt2 drafts, the target verifies) and reports
+tokens/s, the draft acceptance rate and whether the greedy outputs match.
+
+By default everything is local and offline. The draft is the stand-in model
+from pipeline_stages.py. The target is a deeper copy of it: the draft's layers
+plus --extra-layers new blocks whose output projections are scaled by
+--divergence. With 0 the target predicts exactly like the draft (every draft
+token accepted); larger values make it disagree more often, which shows how
+the speed-up follows the acceptance rate. The stand-in draft is never confident
+about its tokens, so offline runs default to --confidence 0 (draft rounds are not
+cut short by transformers' confidence threshold).
+
+Pass --draft and --target (hub ids or local checkpoint paths, same vocabulary)
+to measure real models, e.g. --draft distilgpt2 --target gpt2-medium.
+
+The acceptance rate is derived from forward-pass counts: every verification
+step of the target keeps the accepted draft tokens plus one of its own, so
+accepted = generated - target steps, out of one proposed token per draft pass.
+
+Usage:
+    python benchmarks/assisted_decoding.py [--prompts 6] [--new-tokens 64]
+        [--extra-layers 10] [--divergence 0.05] [--draft-tokens N] [--confidence P]
+        [--draft ID --target ID] [--output results.json]
+"""
+
+import argparse
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+
+import torch
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+from pipeline_stages import install_stand_ins
+
+PROMPTS = [
+    "The old lighthouse keeper climbed the stairs one last time, and",
+    "In the city of glass towers, a thief named Mara",
+    "When the dragon finally spoke, the villagers",
+    "Nobody had opened the library's sealed room for a hundred years until",
+    "The robot gardener noticed that the roses",
+    "On the night of the eclipse, the twins",
+    "Captain Reyes read the message twice before",
+    "Beneath the frozen lake, something",
+]
+
+
+def deeper_copy(draft, extra_layers: int, divergence: float, seed: int = 0):
+    """The draft's blocks followed by `extra_layers` new ones whose residual updates are scaled by `divergence`."""
+    torch.manual_seed(seed)
+    target = copy.deepcopy(draft)
+    template = target.transformer.h[-1]
+    for _ in range(extra_layers):
+        block = copy.deepcopy(template)
+        for module in block.modules():
+            if hasattr(module, "reset_parameters") and module is not block:
+                module.reset_parameters()
+        with torch.no_grad():
+            block.attn.c_proj.weight.normal_(std=0.02).mul_(divergence)
+            block.mlp.c_proj.weight.normal_(std=0.02).mul_(divergence)
+            block.attn.c_proj.bias.zero_()
+            block.mlp.c_proj.bias.zero_()
+        target.transformer.h.append(block)
+    target.config.n_layer = len(target.transformer.h)
+    for index, block in enumerate(target.transformer.h):
+        block.attn.layer_idx = index
+    return target.eval()
+
+
+class ForwardCounter:
+    """Counts forward passes of a model, and the tokens its generate() calls add."""
+
+    def __init__(self, model):
+        self.calls = 0
+        self.new_tokens = 0
+        model.register_forward_hook(self._hook)
+        generate = model.generate
+
+        def counting_generate(input_ids, *args, **kwargs):
+            output = generate(input_ids, *args, **kwargs)
+            # Single sequences only (as assisted decoding runs), so there is no padding to exclude.
+            # The draft's own generate() calls inside assisted decoding return a ModelOutput.
+            sequences = getattr(output, "sequences", output)
+            self.new_tokens += sequences.shape[1] - input_ids.shape[1]
+            return output
+
+        model.generate = counting_generate
+
+    def _hook(self, module, inputs, output):
+        self.calls += 1
+
+
+def load(name: str) -> tuple:
+    """Tokenizer and model for a hub id or checkpoint path, set up like the registry's distilgpt2."""
+    from transformers import AutoTokenizer
+    from modules import model_registry
+    from modules.inference_backends import load_causal_lm
+    tokenizer = AutoTokenizer.from_pretrained(name)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    return tokenizer, load_causal_lm(name, device=model_registry.device())
+
+
+def target_only(tokenizer, target, prompt: str, new_tokens: int) -> str:
+    """Greedy decoding with the target alone, with generate_idea's settings."""
+    input_ids = torch.tensor([tokenizer(prompt).input_ids], device=target.device)
+    output = target.generate(
+        input_ids,
+        attention_mask=torch.ones_like(input_ids),
+        max_new_tokens=new_tokens,
+        no_repeat_ngram_size=2,
+        pad_token_id=tokenizer.pad_token_id,
+        do_sample=False,
+    )
+    return tokenizer.decode(output[0], skip_special_tokens=True)
+
+
+def run(generate, prompts: list, new_tokens: int, target_calls, draft_calls) -> tuple:
+    target_before, draft_before = target_calls.calls, draft_calls.calls
+    tokens_before = target_calls.new_tokens
+    outputs, elapsed = [], 0.0
+    for prompt in prompts:
+        start = time.perf_counter()
+        outputs.append(generate(prompt))
+        elapsed += time.perf_counter() - start
+    generated = target_calls.new_tokens - tokens_before
+    result = {
+        "tokens_per_second": round(generated / elapsed, 1),
+        "seconds": round(elapsed, 2),
+        "generated_tokens": generated,
+        "target_forward_passes": target_calls.calls - target_before,
+        "draft_forward_passes": draft_calls.calls - draft_before,
+    }
+    return result, outputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--prompts", type=int, default=6, help="Number of prompts (at most %d)" % len(PROMPTS))
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--extra-layers", type=int, default=10, help="Blocks the local target adds to the draft")
+    parser.add_argument("--divergence", type=float, default=0.05, help="How far the local target drifts from the draft")
+    parser.add_argument("--draft-tokens", type=int, help="Draft tokens per round to start with (ASSISTED_DRAFT_TOKENS)")
+    parser.add_argument("--confidence", type=float, help="Draft confidence threshold (ASSISTED_CONFIDENCE)")
+    parser.add_argument("--draft", help="Draft model id or path (default: the offline stand-in)")
+    parser.add_argument("--target", help="Target model id or path (default: built from the draft)")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        from modules import generation_cache, idea_generator, model_registry
+        if not args.draft:
+            install_stand_ins(workdir)
+        else:
+            model_registry.register("distilgpt2", lambda: load(args.draft))
+        if args.target:
+            model_registry.register("gpt2_target", lambda: load(args.target))
+        else:
+            target = deeper_copy(model_registry.get("distilgpt2")[1], args.extra_layers, args.divergence)
+            model_registry.register("gpt2_target", lambda: (idea_generator.get_tokenizer(), target))
+        generation_cache.ENABLED = False
+        idea_generator.ASSISTED_DECODING = True
+        idea_generator.ASSISTED_DRAFT_TOKENS = args.draft_tokens
+        idea_generator.ASSISTED_CONFIDENCE = 0.0 if args.confidence is None and not args.draft else args.confidence
+
+        tokenizer = idea_generator.get_tokenizer()
+        target = model_registry.get("gpt2_target")[1]
+        draft_calls = ForwardCounter(model_registry.get("distilgpt2")[1])
+        target_calls = ForwardCounter(target)
+        prompts = PROMPTS[:args.prompts]
+
+        def assisted(prompt):
+            return idea_generator.generate_idea(prompt, max_length=len(tokenizer(prompt).input_ids) + args.new_tokens)
+
+        # Warm up both paths.
+        target_only(tokenizer, target, prompts[0], 4)
+        assisted(prompts[0])
+        results, outputs = {}, {}
+        results["target_only"], outputs["target_only"] = run(
+            lambda prompt: target_only(tokenizer, target, prompt, args.new_tokens),
+            prompts, args.new_tokens, target_calls, draft_calls,
+        )
+        results["assisted"], outputs["assisted"] = run(
+            assisted, prompts, args.new_tokens, target_calls, draft_calls
+        )
+        os.chdir(parent_dir)
+
+    assisted_result = results["assisted"]
+    accepted = assisted_result["generated_tokens"] - assisted_result["target_forward_passes"]
+    proposed = assisted_result["draft_forward_passes"]
+    results["acceptance_rate"] = round(accepted / proposed, 3) if proposed else 0.0
+    results["identical_outputs"] = sum(a == b for a, b in zip(outputs["target_only"], outputs["assisted"]))
+    results["speedup"] = round(assisted_result["tokens_per_second"] / results["target_only"]["tokens_per_second"], 2)
+
+    for mode in ("target_only", "assisted"):
+        r = results[mode]
+        print(f"{mode:<12} {r['tokens_per_second']:>8} tok/s  {r['generated_tokens']:>5} tokens  "
+              f"target passes {r['target_forward_passes']:>5}  draft passes {r['draft_forward_passes']:>5}")
+    print(f"acceptance rate {results['acceptance_rate']}, speed-up x{results['speedup']}, "
+          f"identical greedy outputs {results['identical_outputs']}/{len(prompts)}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(vars(args) | results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+backends.py
+
+Benchmarks the inference backends from modules/inference_backends.py (fp32,
+int8, onnx) on a causal LM and checks their outputs against fp32.
+
+Each backend is loaded in its own subprocess so its resident memory can be
+measured in isolation. For every backend it reports:
+  - load time and resident memory (RSS) after loading,
+  - greedy decoding throughput in new tokens per second,
+  - parity with fp32: the share of prompts whose generated tokens match exactly
+    and the average length of the common prefix (as a fraction of new tokens).
+
+Usage:
+    python benchmarks/backends.py [--model distilgpt2] [--backends fp32,int8] [--new-tokens 64]
+
+--model accepts a hub id or a local checkpoint directory (model + tokenizer).
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from queue import Empty
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+PROMPTS = [
+    "Once upon a time, in a kingdom by the sea,",
+    "The detective looked at the letter and said",
+    "Analyze the following story and determine the most fitting literary genre.",
+    "The spaceship drifted silently past the last moon of Jupiter, and",
+]
+
+
+def run_backend(model_name: str, backend: str, new_tokens: int, queue) -> None:
+    """Loads one backend, generates for every prompt and puts the results on `queue`."""
+    import torch
+    from transformers import AutoTokenizer
+    from modules.inference_backends import load_causal_lm
+    from modules.model_registry import current_rss_bytes
+
+    torch.manual_seed(0)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    start = time.perf_counter()
+    model = load_causal_lm(model_name, backend=backend, device=torch.device("cpu"))
+    load_seconds = time.perf_counter() - start
+
+    outputs, decode_seconds, generated = [], 0.0, 0
+    for prompt in PROMPTS:
+        inputs = tokenizer(prompt, return_tensors="pt")
+        start = time.perf_counter()
+        output = model.generate(
+            inputs.input_ids,
+            attention_mask=inputs.attention_mask,
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            no_repeat_ngram_size=2,
+            pad_token_id=tokenizer.eos_token_id,
+        )
+        decode_seconds += time.perf_counter() - start
+        new_ids = output[0, inputs.input_ids.shape[1]:].tolist()
+        generated += len(new_ids)
+        outputs.append(new_ids)
+
+    queue.put({
+        "backend": backend,
+        "load_seconds": round(load_seconds, 2),
+        "rss_mb": round(current_rss_bytes() / 2**20, 1),
+        "tokens_per_second": round(generated / decode_seconds, 1),
+        "outputs": outputs,
+    })
+
+
+def wait_for_result(process, queue, backend: str) -> dict:
+    while True:
+        try:
+            return queue.get(timeout=1)
+        except Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Backend '{backend}' failed (exit code {process.exitcode})")
+
+
+def parity(reference: list, candidate: list) -> dict:
+    exact = sum(ref == cand for ref, cand in zip(reference, candidate))
+    prefix_fractions = []
+    for ref, cand in zip(reference, candidate):
+        common = 0
+        for a, b in zip(ref, cand):
+            if a != b:
+                break
+            common += 1
+        prefix_fractions.append(common / max(len(ref), 1))
+    return {
+        "exact_match_rate": round(exact / len(reference), 3),
+        "mean_common_prefix": round(sum(prefix_fractions) / len(prefix_fractions), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="distilgpt2")
+    parser.add_argument("--backends", default="fp32,int8", help="Comma-separated; fp32 is always included")
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    args = parser.parse_args()
+
+    backends = ["fp32"] + [b for b in args.backends.split(",") if b and b != "fp32"]
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for backend in backends:
+        queue = context.Queue()
+        process = context.Process(target=run_backend, args=(args.model, backend, args.new_tokens, queue))
+        process.start()
+        results[backend] = wait_for_result(process, queue, backend)
+        process.join()
+
+    reference = results["fp32"]["outputs"]
+    report = []
+    for backend in backends:
+        result = results[backend]
+        row = {key: value for key, value in result.items() if key != "outputs"}
+        row.update(parity(reference, result["outputs"]))
+        report.append(row)
+
+    print(f"{'backend':<8} {'load s':>7} {'RSS MB':>8} {'tok/s':>8} {'exact':>6} {'prefix':>7}")
+    for row in report:
+        print(f"{row['backend']:<8} {row['load_seconds']:>7} {row['rss_mb']:>8} {row['tokens_per_second']:>8} "
+              f"{row['exact_match_rate']:>6} {row['mean_common_prefix']:>7}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"model": args.model, "new_tokens": args.new_tokens, "results": report}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
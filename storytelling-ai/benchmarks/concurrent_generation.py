@@ -0,0 +1,110 @@
+"""
+concurrent_generation.py
+
+Measures generate_idea throughput when many threads call it at once (as the
+Flask apps' request threads do), with and without the cross-request batch
+scheduler (modules/batch_scheduler.py).
+
+Each thread sends its own distinct prompts one after another. The generation
+cache is turned off so every call does the real work. By default the tiny
+stand-in model from pipeline_stages.py is used; pass --real to use distilgpt2.
+
+Usage:
+    python benchmarks/concurrent_generation.py [--threads 8] [--requests 4] [--new-tokens 40]
+        [--window-ms 10] [--max-batch-size 8] [--real] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+from pipeline_stages import install_stand_ins, percentile
+
+SUBJECTS = ["a lighthouse keeper", "a dragon", "two rival bakers", "a lost robot", "a river spirit",
+            "an old map", "a travelling circus", "a silent town"]
+
+
+def run(threads: int, requests: int, new_tokens: int) -> dict:
+    from modules import idea_generator
+
+    tokenizer = idea_generator.get_tokenizer()
+    latencies, lock = [], threading.Lock()
+
+    def client(index: int):
+        for n in range(requests):
+            prompt = f"Write a short story about {SUBJECTS[(index + n) % len(SUBJECTS)]} (request {index}-{n}):"
+            max_length = len(tokenizer(prompt).input_ids) + new_tokens
+            start = time.perf_counter()
+            idea_generator.generate_idea(prompt, max_length=max_length)
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    workers = [threading.Thread(target=client, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return {
+        "requests_per_second": round(len(latencies) / elapsed, 2),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "elapsed_s": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent callers")
+    parser.add_argument("--requests", type=int, default=4, help="Requests per caller")
+    parser.add_argument("--new-tokens", type=int, default=40, help="New tokens per request")
+    parser.add_argument("--window-ms", type=float, default=10, help="Batch collection window")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--real", action="store_true", help="Use distilgpt2 instead of the tiny stand-in")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if not args.real:
+            install_stand_ins(workdir)
+        from modules import generation_cache, idea_generator
+        generation_cache.ENABLED = False
+        batcher = idea_generator._batcher
+        batcher.window = args.window_ms / 1000
+        batcher.max_batch_size = args.max_batch_size
+
+        idea_generator.generate_idea("Warm up:", max_length=8)
+        results = {}
+        for mode, enabled in (("unbatched", False), ("batched", True)):
+            batcher.enabled = enabled
+            results[mode] = run(args.threads, args.requests, args.new_tokens)
+            print(f"{mode:<10} {results[mode]['requests_per_second']:>8} req/s  "
+                  f"p50 {results[mode]['p50_ms']:>8} ms  p95 {results[mode]['p95_ms']:>8} ms")
+        results["scheduler"] = idea_generator.batch_stats()
+        os.chdir(parent_dir)
+
+    stats = results["scheduler"]
+    print(f"batches {stats['batches']}, mean size {stats['mean_batch_size']}, max size {stats['max_batch_size']}, "
+          f"mean queue wait {stats['mean_queue_wait_ms']} ms, max {stats['max_queue_wait_ms']} ms")
+    speedup = results["batched"]["requests_per_second"] / results["unbatched"]["requests_per_second"]
+    print(f"Throughput x{speedup:.2f} with batching")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(vars(args) | results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+context_reuse.py
+
+Compares the follow-up prompts of the story pipeline (genre, premise, title and
+one summary per character) with and without a shared StoryContext.
+
+The "full prompt" path re-encodes the whole story for every prompt, as the
+pipeline used to do; the "context" path encodes it once and branches each
+instruction off the cached past_key_values.
+
+Usage:
+    python benchmarks/context_reuse.py [story_id] [--characters N]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from modules.idea_generator import StoryContext, generate_idea, get_tokenizer
+from modules.story_manager import load_all_stories
+from integration import pipeline
+
+
+def follow_up_prompts(num_characters: int) -> list:
+    """Returns (instruction, max_new_tokens) pairs in the order the pipeline issues them."""
+    prompts = [
+        (pipeline.GENRE_INSTRUCTION, pipeline.GENRE_MAX_NEW_TOKENS),
+        (pipeline.PREMISE_INSTRUCTION, pipeline.PREMISE_MAX_NEW_TOKENS),
+        (pipeline.TITLE_INSTRUCTION, pipeline.TITLE_MAX_NEW_TOKENS),
+    ]
+    for i in range(num_characters):
+        prompts.append((pipeline.backstory_instruction(f"Character {i + 1}"), pipeline.BACKSTORY_MAX_NEW_TOKENS))
+    return prompts
+
+
+def run_full_prompts(story: str, prompts: list) -> float:
+    start = time.perf_counter()
+    for instruction, max_new_tokens in prompts:
+        prompt = story + instruction
+        prompt_tokens = len(get_tokenizer()(prompt).input_ids)
+        generate_idea(prompt, max_length=prompt_tokens + max_new_tokens)
+    return time.perf_counter() - start
+
+
+def run_context(story: str, prompts: list) -> float:
+    start = time.perf_counter()
+    context = StoryContext(story)
+    for instruction, max_new_tokens in prompts:
+        context.generate(instruction, max_new_tokens)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("story_id", nargs="?", help="Story to use from stories.json (default: the longest one)")
+    parser.add_argument("--characters", type=int, default=5, help="Number of character summaries to request")
+    parser.add_argument("--max-story-tokens", type=int, default=700,
+                        help="Truncate the story so prompt plus answer fit in the 1024-token window")
+    args = parser.parse_args()
+
+    stories = load_all_stories()
+    if not stories:
+        print("No stories found in stories.json.")
+        return
+    if args.story_id:
+        story = stories[args.story_id]["content"]
+    else:
+        story = max((s["content"] for s in stories.values()), key=len)
+
+    tokenizer = get_tokenizer()
+    story_ids = tokenizer(story).input_ids[:args.max_story_tokens]
+    story = tokenizer.decode(story_ids)
+    prompts = follow_up_prompts(args.characters)
+    story_tokens = len(story_ids)
+    print(f"Story length: {story_tokens} tokens, {len(prompts)} follow-up prompts")
+
+    # Warm up so one-off allocation costs don't land on either path.
+    generate_idea("Warm up", max_length=5)
+
+    full_time = run_full_prompts(story, prompts)
+    context_time = run_context(story, prompts)
+    print(f"Full prompts: {full_time:.2f}s")
+    print(f"StoryContext: {context_time:.2f}s ({full_time / context_time:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+gateway_memory.py
+
+Compares resident memory of the three-process setup (app.py, app2.py and
+app3.py each in their own process) with the single-process gateway
+(integration/gateway.py) serving the same endpoints.
+
+Each configuration runs in a fresh subprocess that imports the app, loads the
+models its endpoints use and answers one request per endpoint, then reports its
+RSS. The three-process total is the sum of the three app processes.
+
+By default the offline stand-ins from pipeline_stages.py are used (tiny models,
+local image server), which shows the per-process baseline (Python, torch,
+transformers) paid once per app. Pass --real to load the production models
+(requires them to be downloadable or cached).
+
+Usage:
+    python benchmarks/gateway_memory.py [--real] [--no-requests] [--output results.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+STORY_PROMPT = "Once upon a time, a young knight named Alice rode to the castle of Bob"
+FEEDBACK_TEXT = "Alice rode to the castle. She said teh words and did not recieve an answer."
+
+# Models each app's endpoints load, and one request per endpoint: (path, JSON body).
+APPS = {
+    "app": {
+        "module": "integration.app",
+        "models": [],
+        "requests": [("/generate_images", {"prompt": "a castle at dawn", "num_images": 1})],
+    },
+    "app2": {
+        "module": "integration.app2",
+        "models": ["languagetool", "sentiment", "distilgpt2"],
+        "requests": [("/feedback", {"text": FEEDBACK_TEXT})],
+    },
+    "app3": {
+        "module": "integration.app3",
+        "models": ["distilgpt2", "dialogpt", "spacy"],
+        "requests": [("/generate_story", {"prompt": STORY_PROMPT, "genre": "fantasy"})],
+    },
+}
+APPS["gateway"] = {
+    "module": "integration.gateway",
+    "models": sorted({model for name in ("app", "app2", "app3") for model in APPS[name]["models"]}),
+    "requests": [request for name in ("app", "app2", "app3") for request in APPS[name]["requests"]],
+}
+
+
+def run_worker(name: str, real: bool, send_requests: bool) -> dict:
+    """Runs inside the subprocess: loads one configuration and returns its memory use."""
+    import importlib
+    from werkzeug.test import Client
+    from modules import model_registry
+
+    if not real:
+        from pipeline_stages import install_stand_ins
+        install_stand_ins(tempfile.mkdtemp())
+
+    config = APPS[name]
+    module = importlib.import_module(config["module"])
+    wsgi_app = module.application if name == "gateway" else module.app
+    if config["models"]:
+        # warmup() with no names would load every registered model.
+        model_registry.warmup(config["models"])
+    statuses = []
+    if send_requests:
+        client = Client(wsgi_app)
+        for path, body in config["requests"]:
+            statuses.append(client.post(path, json=body).status_code)
+
+    import resource
+    return {
+        "name": name,
+        "rss_mb": round(model_registry.current_rss_bytes() / 2**20, 1),
+        # ru_maxrss is in kilobytes on Linux.
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "statuses": statuses,
+    }
+
+
+def measure(name: str, real: bool, send_requests: bool) -> dict:
+    command = [sys.executable, os.path.abspath(__file__), "--worker", name]
+    if real:
+        command.append("--real")
+    if not send_requests:
+        command.append("--no-requests")
+    output = subprocess.run(command, check=True, capture_output=True, text=True, cwd=parent_dir).stdout
+    # The result is the last line; the apps may print before it.
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--real", action="store_true", help="Load the production models instead of stand-ins")
+    parser.add_argument("--no-requests", action="store_true", help="Only load the models, send no requests")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.real, not args.no_requests)))
+        return
+
+    results = {name: measure(name, args.real, not args.no_requests) for name in APPS}
+    separate = {
+        "rss_mb": round(sum(results[name]["rss_mb"] for name in ("app", "app2", "app3")), 1),
+        "peak_rss_mb": round(sum(results[name]["peak_rss_mb"] for name in ("app", "app2", "app3")), 1),
+    }
+
+    print(f"{'process':<14} {'RSS MB':>8} {'peak MB':>8}  statuses")
+    for name, result in results.items():
+        print(f"{name:<14} {result['rss_mb']:>8} {result['peak_rss_mb']:>8}  {result['statuses']}")
+    print(f"{'3 processes':<14} {separate['rss_mb']:>8} {separate['peak_rss_mb']:>8}")
+    saved = separate["rss_mb"] - results["gateway"]["rss_mb"]
+    print(f"Gateway saves {saved:.1f} MB RSS ({saved / separate['rss_mb'] * 100:.0f}%)")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"real_models": args.real, "processes": results, "three_processes": separate}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
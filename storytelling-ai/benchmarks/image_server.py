@@ -0,0 +1,105 @@
+"""
+image_server.py
+
+A local stand-in for the pollinations.ai image service, for testing and
+benchmarking modules/image_generator.py without network access.
+
+GET /prompt/<anything> waits `delay` seconds and returns a random PNG.
+
+Usage:
+    python benchmarks/image_server.py [--port 8765] [--delay 1.0] [--images 4]
+
+With --images N it starts the server, points image_generator at it and reports
+the wall time of generate_images(num_images=N) next to a single fetch. The
+timing bypasses the image cache and saves into a temporary directory, so every
+image is really downloaded and data/generate_images is left alone.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cv2
+import numpy as np
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+
+def random_png(width: int = 256, height: int = 256) -> bytes:
+    image = np.random.randint(0, 256, (height, width, 3), dtype=np.uint8)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def start_image_server(port: int = 0, delay: float = 0.0, width: int = 256, height: int = 256):
+    """
+    Starts the stand-in server on a background thread.
+    Returns (server, base_url); the base URL can be used as image_generator.IMAGE_API_URL.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_GET(self):
+            if not self.path.startswith("/prompt/"):
+                self.send_error(404)
+                return
+            time.sleep(delay)
+            body = random_png(width, height)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/prompt"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=1.0, help="Seconds the server waits per image")
+    parser.add_argument("--images", type=int, default=0, help="Run a generate_images timing with N images")
+    args = parser.parse_args()
+
+    server, base_url = start_image_server(args.port, args.delay)
+    print(f"Serving stand-in images at {base_url}/<prompt>")
+    if not args.images:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            return
+
+    from modules import image_generator
+    image_generator.IMAGE_API_URL = base_url
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Images are saved relative to the working directory.
+        os.chdir(workdir)
+        start = time.perf_counter()
+        image_generator.generate_images("benchmark prompt", num_images=1, use_cache=False)
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        urls = image_generator.generate_images("benchmark prompt", num_images=args.images, use_cache=False)
+        batch = time.perf_counter() - start
+        os.chdir(parent_dir)
+
+    print(f"1 image: {single:.2f}s, {args.images} images: {batch:.2f}s ({len(set(urls))} unique files)")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+pipeline_stages.py
+
+Offline benchmark of every stage in integration/pipeline.py, feedback_module
+and image_generator.
+
+No network is needed: the model registry is pointed at tiny, randomly
+initialised GPT-2 / DialoGPT / DistilBERT models that share a byte-level BPE
+tokenizer trained on the fly, LanguageTool is replaced by a small rule-based
+stand-in, NER by a blank spaCy pipeline with an entity ruler, images come from
+the local stand-in server, and stories are written to a temporary SQLite database.
+Absolute numbers are therefore much lower than production, but they are stable
+enough to compare commits.
+
+For each stage it reports latency percentiles (p50/p90/p99), tokens/s for the
+generation stages, and the peak RSS of the process.
+
+Usage:
+    python benchmarks/pipeline_stages.py [--repeats 5] [--output results.json] [--compare old.json]
+"""
+
+import argparse
+import functools
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+STORY_PROMPT = "Once upon a time, a young knight named Alice rode to the castle of Bob"
+
+CORPUS = [
+    "Once upon a time there was a dragon named Ember who lived beyond the hills.",
+    "The knight Alice met Bob in the castle, and together they planned the escape.",
+    "\"We have to leave tonight,\" she said. \"The guards will not wait for us.\"",
+    "Analyze the following story and determine the most fitting literary genre.",
+    "Genre: fantasy\nTitle: The Last Dragon\nPremise: a knight and a thief save a kingdom.",
+    "List three surprising and unique plot twists for the following story.",
+    "- The dragon was the king all along.\n- Bob is Alice's brother.\n- The castle is a dream.",
+]
+
+
+# ---------------------------------------------------------------------
+# OFFLINE STAND-INS
+# ---------------------------------------------------------------------
+
+def build_tokenizer(model_max_length: int = 1024):
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import PreTrainedTokenizerFast
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(CORPUS * 20, vocab_size=1000, special_tokens=["<|endoftext|>"])
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe._tokenizer,
+        eos_token="<|endoftext|>", bos_token="<|endoftext|>", unk_token="<|endoftext|>",
+        model_max_length=model_max_length,
+    )
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    # Neither GPT-2 nor DistilBERT take token_type_ids.
+    tokenizer.model_input_names = ["input_ids", "attention_mask"]
+    return tokenizer
+
+
+def tiny_gpt2(tokenizer, n_layer: int = 2, n_embd: int = 64):
+    import torch
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    torch.manual_seed(0)
+    config = GPT2Config(
+        vocab_size=len(tokenizer), n_positions=2048, n_embd=n_embd, n_layer=n_layer, n_head=2,
+        bos_token_id=tokenizer.eos_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    return GPT2LMHeadModel(config).eval()
+
+
+def tiny_sentiment(tokenizer):
+    import torch
+    from transformers import DistilBertConfig, DistilBertForSequenceClassification, pipeline
+
+    torch.manual_seed(0)
+    config = DistilBertConfig(
+        vocab_size=len(tokenizer), dim=64, hidden_dim=128, n_layers=2, n_heads=2,
+        pad_token_id=tokenizer.pad_token_id,
+        id2label={0: "NEGATIVE", 1: "POSITIVE"}, label2id={"NEGATIVE": 0, "POSITIVE": 1},
+    )
+    model = DistilBertForSequenceClassification(config).eval()
+    return pipeline("sentiment-analysis", model=model, tokenizer=tokenizer, device=-1)
+
+
+class StandInLanguageTool:
+    """Flags a few common misspellings, returning LanguageTool-shaped matches."""
+
+    TYPOS = {"teh": "the", "recieve": "receive", "wich": "which", "alot": "a lot"}
+
+    def check(self, text: str) -> list:
+        matches = []
+        for match in re.finditer(r"\b(" + "|".join(self.TYPOS) + r")\b", text):
+            matches.append(types.SimpleNamespace(
+                offset=match.start(), errorLength=len(match.group()), ruleId="MORFOLOGIK_RULE_EN_US",
+                message="Possible spelling mistake found.", replacements=[self.TYPOS[match.group()]],
+            ))
+        return matches
+
+
+def stand_in_ner():
+    """A blank English spaCy pipeline whose entity ruler tags the corpus characters."""
+    import spacy
+
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "PERSON", "pattern": name} for name in ("Alice", "Bob", "Ember")])
+    return nlp
+
+
+def install_stand_ins(workdir: str) -> str:
+    """Points the model registry, story store and image service at the offline stand-ins."""
+    from modules import model_registry, story_manager, image_generator
+    from image_server import start_image_server
+
+    # Built on first use, so processes that load no model don't import transformers.
+    tokenizer = functools.lru_cache(maxsize=None)(lambda: build_tokenizer(model_max_length=2048))
+    model_registry.register("distilgpt2", lambda: (tokenizer(), tiny_gpt2(tokenizer())))
+    model_registry.register("dialogpt", lambda: (tokenizer(), tiny_gpt2(tokenizer(), n_layer=3)))
+    model_registry.register("sentiment", lambda: tiny_sentiment(build_tokenizer(model_max_length=512)))
+    model_registry.register("languagetool", StandInLanguageTool)
+    model_registry.register("spacy", stand_in_ner)
+
+    story_manager.set_store(story_manager.SqliteStoryStore(os.path.join(workdir, "stories.db")))
+
+    _, base_url = start_image_server()
+    image_generator.IMAGE_API_URL = base_url
+    # Images are saved relative to the working directory.
+    os.chdir(workdir)
+    return base_url
+
+
+# ---------------------------------------------------------------------
+# MEASUREMENT
+# ---------------------------------------------------------------------
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(fn, repeats: int) -> dict:
+    """Runs fn once to warm up, then `repeats` times. fn may return a generated-token count (int)."""
+    fn()
+    latencies, tokens = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        produced = fn()
+        latencies.append(time.perf_counter() - start)
+        if isinstance(produced, int):
+            tokens += produced
+    result = {
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 2),
+    }
+    if tokens:
+        result["tokens_per_second"] = round(tokens / sum(latencies), 1)
+    return result
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux.
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def stages(story_tokens: int) -> dict:
+    """Returns {stage name: zero-argument callable} for every benchmarked stage."""
+    from modules import feedback_module, story_manager
+    from modules.dialogue_improver import improve_dialogue
+    from modules.idea_generator import generate_idea, get_tokenizer
+    from modules.image_generator import generate_images
+    from integration import pipeline
+
+    tokenizer = get_tokenizer()
+    prompt_tokens = len(tokenizer(STORY_PROMPT).input_ids)
+    story = generate_idea(STORY_PROMPT, max_length=prompt_tokens + story_tokens)
+    draft = story + "\n\nShe said teh words and did not recieve an answer."
+
+    def count_new(text: str, prompt: str) -> int:
+        return max(0, len(tokenizer(text).input_ids) - len(tokenizer(prompt).input_ids))
+
+    def generation():
+        return count_new(generate_idea(STORY_PROMPT, max_length=prompt_tokens + story_tokens), STORY_PROMPT)
+
+    def metadata():
+        pipeline.extract_metadata_from_story(story)
+        return pipeline.GENRE_MAX_NEW_TOKENS + pipeline.PREMISE_MAX_NEW_TOKENS + pipeline.TITLE_MAX_NEW_TOKENS
+
+    def dialogue():
+        improved = improve_dialogue(story)
+        return count_new(improved, story)
+
+    def persistence():
+        story_manager.update_story_metadata("benchmark", title="Title", premise="Premise", genre="Genre")
+        story_manager.append_story_content("benchmark", story)
+
+    def full_feedback():
+        # Clear the memoised results so every run does the real work.
+        feedback_module._results_cache.clear()
+        feedback_module._paragraph_matches_cache.clear()
+        feedback_module.feedback(draft)
+
+    return {
+        "pipeline.generate": generation,
+        "pipeline.metadata": metadata,
+        "pipeline.improve_dialogue": dialogue,
+        "pipeline.persistence": persistence,
+        "pipeline.generate_story": lambda: pipeline.generate_story(STORY_PROMPT, "benchmark-story"),
+        "feedback.grammar": lambda: feedback_module.grammar_feedback(draft, incremental=False),
+        "feedback.tone": lambda: feedback_module.tone_curve(draft),
+        "feedback.suggestions": lambda: feedback_module.suggest_title_and_twists(draft),
+        "feedback.feedback": full_feedback,
+        "feedback.feedback_cached": lambda: feedback_module.feedback(draft),
+        "images.generate_uncached": lambda: generate_images("a castle at dawn", 2, use_cache=False),
+        "images.generate_cached": lambda: generate_images("a castle at dawn", 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=parent_dir, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(previous: dict, current: dict) -> None:
+    print(f"\n{'stage':<28} {'old p50':>9} {'new p50':>9} {'change':>8}")
+    for name, result in current["stages"].items():
+        old = previous.get("stages", {}).get(name)
+        if not old:
+            continue
+        change = (result["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        print(f"{name:<28} {old['p50_ms']:>9} {result['p50_ms']:>9} {change:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--story-tokens", type=int, default=200, help="New tokens per generated story")
+    parser.add_argument("--only", help="Run only stages whose name contains this string")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Print p50 changes against a previous results file")
+    parser.add_argument("--generation-cache", action="store_true",
+                        help="Keep the generation cache on (by default every run does the real work)")
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    previous_path = os.path.abspath(args.compare) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        install_stand_ins(workdir)
+        if not args.generation_cache:
+            from modules import generation_cache
+            generation_cache.ENABLED = False
+        results = {}
+        for name, fn in stages(args.story_tokens).items():
+            if args.only and args.only not in name:
+                continue
+            results[name] = measure(fn, args.repeats)
+            print(f"{name:<28} p50 {results[name]['p50_ms']:>9} ms  p99 {results[name]['p99_ms']:>9} ms"
+                  + (f"  {results[name]['tokens_per_second']} tok/s" if "tokens_per_second" in results[name] else ""))
+        os.chdir(parent_dir)
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeats": args.repeats,
+        "story_tokens": args.story_tokens,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": results,
+    }
+    print(f"Peak RSS: {report['peak_rss_mb']} MB")
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+    if previous_path:
+        with open(previous_path, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
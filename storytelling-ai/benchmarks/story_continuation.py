@@ -0,0 +1,70 @@
+"""
+story_continuation.py
+
+Shows that continue_story costs the same per chapter however long the story is:
+a story is grown chapter by chapter and, for each chapter, the stored story
+length, the continuation prompt length and the time taken are printed.
+
+The offline stand-ins from pipeline_stages.py are used (tiny models, temporary
+story database), with the generation cache off so every chapter does the real work.
+
+Usage:
+    python benchmarks/story_continuation.py [--chapters 12] [--new-tokens 200]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+# Add the project root (one level up from benchmarks/) to sys.path.
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+if current_dir not in sys.path:
+    sys.path.append(current_dir)
+
+from pipeline_stages import install_stand_ins
+
+OPENING = (
+    "Alice had kept the lighthouse for eleven years when Bob rowed out through the fog. "
+    "He brought a letter, a lantern and a question she did not want to answer."
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, default=12)
+    parser.add_argument("--new-tokens", type=int, default=200, help="New tokens per chapter")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        install_stand_ins(workdir)
+        from modules import generation_cache
+        generation_cache.ENABLED = False
+        from modules.idea_generator import get_tokenizer
+        from modules.story_manager import append_story_content, story_content_length
+        from integration import pipeline
+
+        # Record the prompt each chapter is generated from.
+        prompts = []
+        generate_idea = pipeline.generate_idea
+        pipeline.generate_idea = lambda prompt, **kw: prompts.append(prompt) or generate_idea(prompt, **kw)
+
+        story_id = "continuation-benchmark"
+        append_story_content(story_id, OPENING)
+        print(f"{'chapter':>7} {'story chars':>12} {'prompt tokens':>14} {'seconds':>8}")
+        for chapter in range(1, args.chapters + 1):
+            start = time.perf_counter()
+            pipeline.continue_story(story_id, f"Chapter {chapter}: the storm reaches the island.",
+                                    max_new_tokens=args.new_tokens)
+            elapsed = time.perf_counter() - start
+            prompt_tokens = len(get_tokenizer()(prompts[-1]).input_ids)
+            print(f"{chapter:>7} {story_content_length(story_id):>12} {prompt_tokens:>14} {elapsed:>8.2f}")
+        os.chdir(parent_dir)
+
+
+if __name__ == "__main__":
+    main()
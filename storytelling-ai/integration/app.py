@@ -8,20 +8,34 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 from flask import Flask, request, jsonify, send_from_directory, render_template_string
-from modules.image_generator import generate_images
+from modules.image_generator import generate_images, variant_filename, VARIANT_WIDTHS
+from modules import metrics
 
 app = Flask(__name__)
+# Request timings plus image/cache metrics at GET /metrics (METRICS_ENABLED=0 turns recording off).
+metrics.install(app)
 
 @app.route("/", methods=["GET"])
 def index():
     return render_template_string("<h1>Flask API is running</h1><p>Use the /generate_images endpoint to generate images.</p>")
 
+# How long browsers may reuse an image before revalidating it (seconds).
+IMAGE_MAX_AGE = 24 * 60 * 60
+
 # Serve generated images from the "data/generate_images" folder via /donate/images/<filename>
+# Add ?size=thumb or ?size=web for a pre-generated smaller copy (falls back to the full image).
+# Responses carry ETag/Last-Modified, and conditional GETs are answered with 304.
 @app.route("/donate/images/<path:filename>")
 def serve_image(filename):
     images_dir = os.path.join(os.getcwd(), "data", "generate_images")
-    print("Serving image from:", images_dir)
-    return send_from_directory(images_dir, filename)
+    size = request.args.get("size")
+    if size in VARIANT_WIDTHS:
+        variant = variant_filename(filename, size)
+        if os.path.exists(os.path.join(images_dir, variant)):
+            filename = variant
+    return send_from_directory(
+        images_dir, filename, max_age=IMAGE_MAX_AGE, conditional=True, etag=True
+    )
 
 # Endpoint for generating images (POST only).
 @app.route("/generate_images", methods=["POST"])
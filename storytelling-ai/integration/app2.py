@@ -1,9 +1,17 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import os
 from modules.feedback_module import feedback  # adjust import if your structure differs
+from modules import metrics, model_registry
 
 app = Flask(__name__)
 CORS(app)
+# Request timings plus per-stage feedback metrics at GET /metrics (METRICS_ENABLED=0 turns recording off).
+metrics.install(app)
+
+# Models load on first request; set WARMUP_MODELS=1 to preload them at startup instead.
+if os.environ.get("WARMUP_MODELS") == "1":
+    model_registry.warmup(["languagetool", "sentiment", "distilgpt2"])
 
 @app.route('/feedback', methods=['POST'])
 def get_feedback():
@@ -7,14 +7,38 @@ parent_dir = os.path.join(current_dir, "..")
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+import json
 import uuid
-from integration.pipeline import generate_story  # Import from integration folder
+from integration.pipeline import StoryNotFound, continue_story, generate_story, generate_story_events  # Import from integration folder
+from integration.jobs import JobQueue, QueueFullError
+from modules import metrics, model_registry
 
 app = Flask(__name__)
 # Allow only the frontend running on localhost:5173 (adjust as needed)
-CORS(app, resources={r"/generate_story": {"origins": "http://localhost:5173"}})
+CORS(app, resources={
+    r"/generate_story": {"origins": "http://localhost:5173"},
+    r"/generate_story/stream": {"origins": "http://localhost:5173"},
+    r"/continue_story": {"origins": "http://localhost:5173"},
+    r"/jobs/.*": {"origins": "http://localhost:5173"},
+})
+
+# Background story jobs: a fixed worker pool plus a bounded waiting queue.
+story_jobs = JobQueue(
+    generate_story_events,
+    max_workers=int(os.environ.get("STORY_WORKERS", 2)),
+    max_pending=int(os.environ.get("STORY_QUEUE_DEPTH", 8)),
+)
+
+# Request timings, per-stage generation metrics and the job queue depth at GET /metrics
+# (METRICS_ENABLED=0 turns recording off).
+metrics.install(app)
+metrics.register_gauge("story_jobs_depth", story_jobs.depth, "Story jobs queued or running")
+
+# Models load on first request; set WARMUP_MODELS=1 to preload them at startup instead.
+if os.environ.get("WARMUP_MODELS") == "1":
+    model_registry.warmup(["distilgpt2", "dialogpt", "spacy"])
 
 @app.route("/generate_story", methods=["POST"])
 def generate_story_endpoint():
@@ -33,5 +57,83 @@ def generate_story_endpoint():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/generate_story/stream", methods=["POST"])
+def generate_story_stream_endpoint():
+    """
+    Same input as /generate_story, but answers with Server-Sent Events:
+    "token" events carry story text as it is generated, followed by "genre",
+    "premise", "title", "story" and finally "done" with the full result.
+    """
+    data = request.get_json()
+    prompt = data.get("prompt", "").strip()
+    genre = data.get("genre", "").strip()
+
+    if not prompt or not genre:
+        return jsonify({"error": "Prompt and genre are required."}), 400
+
+    story_id = str(uuid.uuid4())
+
+    def event_stream():
+        try:
+            for event in generate_story_events(prompt, story_id):
+                yield f"event: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+
+    return Response(
+        stream_with_context(event_stream()),
+        mimetype="text/event-stream",
+        # Stop reverse proxies from buffering the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.route("/continue_story", methods=["POST"])
+def continue_story_endpoint():
+    """
+    Appends the next part to a stored story. Body: {"story_id": ..., "instruction": ...}.
+    Answers with {"story_id", "text", "characters"}; the cost of a part does not grow
+    with the story (only a recent tail and a stored summary are used as the prompt).
+    """
+    data = request.get_json()
+    story_id = data.get("story_id", "").strip()
+    instruction = data.get("instruction", "").strip()
+
+    if not story_id or not instruction:
+        return jsonify({"error": "story_id and instruction are required."}), 400
+
+    try:
+        return jsonify(continue_story(story_id, instruction))
+    except StoryNotFound:
+        return jsonify({"error": "Unknown story id."}), 404
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route("/jobs/generate_story", methods=["POST"])
+def submit_story_job():
+    """
+    Queues a story generation job and returns its id right away (202).
+    Poll GET /jobs/<job_id> for status, partial results and the final result.
+    """
+    data = request.get_json()
+    prompt = data.get("prompt", "").strip()
+    genre = data.get("genre", "").strip()
+
+    if not prompt or not genre:
+        return jsonify({"error": "Prompt and genre are required."}), 400
+
+    story_id = str(uuid.uuid4())
+    try:
+        job_id = story_jobs.submit(prompt, story_id)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429, {"Retry-After": "10"}
+    return jsonify({"job_id": job_id, "story_id": story_id, "status_url": f"/jobs/{job_id}"}), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_story_job(job_id):
+    job = story_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job id."}), 404
+    return jsonify(job)
+
 if __name__ == "__main__":
     app.run(debug=True, port=5003)
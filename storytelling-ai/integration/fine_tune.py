@@ -1,24 +1,121 @@
 # storytelling-ai/integration/fine_tune.py
 
+import hashlib
+import json
 import os
+import numpy as np
 import torch
+from torch.utils.data import Dataset
 from transformers import (
     GPT2LMHeadModel,
     GPT2Tokenizer,
-    TextDataset,
     DataCollatorForLanguageModeling,
     Trainer,
     TrainingArguments,
 )
 
+# Text is tokenised this many characters at a time (cut at line boundaries), so
+# corpora larger than RAM never have to be held in memory.
+TOKENIZE_CHUNK_CHARS = 1 << 20
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _text_chunks(file_path: str):
+    """Yields the file's text in pieces of about TOKENIZE_CHUNK_CHARS, split after a newline."""
+    buffer, size = [], 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            # Only cut before a non-blank line, so runs of newlines are tokenised together.
+            if size >= TOKENIZE_CHUNK_CHARS and line.strip():
+                yield "".join(buffer)
+                buffer, size = [], 0
+            buffer.append(line)
+            size += len(line)
+    if buffer:
+        yield "".join(buffer)
+
+class TokenBlockDataset(Dataset):
+    """
+    Fixed-size blocks of token ids read from a memory-mapped array on disk.
+
+    The first time a file is used it is tokenised once, chunk by chunk, and its
+    tokens are packed into `block_size` blocks (the trailing partial block is
+    dropped, as TextDataset did). The array is stored next to the source as
+    cached_blocks_<tokenizer>_<block_size>_<file>.bin, with a .json sidecar holding
+    the source's sha256; later runs reuse it until the source file changes.
+    """
+
+    def __init__(self, file_path: str, tokenizer, block_size: int = 128, cache_dir: str = None):
+        self.block_size = block_size
+        directory, filename = os.path.split(os.path.abspath(file_path))
+        tokenizer_name = os.path.basename(str(tokenizer.name_or_path).rstrip("/")) or "tokenizer"
+        stem = os.path.join(cache_dir or directory, f"cached_blocks_{tokenizer_name}_{block_size}_{filename}")
+        self.data_path, self.meta_path = stem + ".bin", stem + ".json"
+        self.dtype = np.uint16 if len(tokenizer) <= np.iinfo(np.uint16).max + 1 else np.uint32
+
+        source_hash = file_sha256(file_path)
+        meta = self._read_meta()
+        if meta is None or meta.get("source_sha256") != source_hash or meta.get("vocab_size") != len(tokenizer):
+            meta = self._build(file_path, tokenizer, source_hash)
+        else:
+            print(f"Using cached token blocks from {self.data_path}")
+        self.num_blocks = meta["num_blocks"]
+        self.blocks = np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(self.num_blocks, block_size)) \
+            if self.num_blocks else np.zeros((0, block_size), dtype=self.dtype)
+
+    def _read_meta(self):
+        try:
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        return meta if os.path.exists(self.data_path) else None
+
+    def _build(self, file_path: str, tokenizer, source_hash: str) -> dict:
+        print(f"Tokenising {file_path} into {self.data_path}")
+        os.makedirs(os.path.dirname(self.data_path), exist_ok=True)
+        if os.path.exists(self.meta_path):
+            os.remove(self.meta_path)
+        tmp_path = self.data_path + ".tmp"
+        total = 0
+        with open(tmp_path, "wb") as out:
+            for text in _text_chunks(file_path):
+                ids = tokenizer(text, add_special_tokens=True).input_ids
+                np.asarray(ids, dtype=self.dtype).tofile(out)
+                total += len(ids)
+        num_blocks = total // self.block_size
+        # Drop the trailing partial block.
+        with open(tmp_path, "r+b") as out:
+            out.truncate(num_blocks * self.block_size * np.dtype(self.dtype).itemsize)
+        os.replace(tmp_path, self.data_path)
+        meta = {
+            "source": os.path.abspath(file_path),
+            "source_sha256": source_hash,
+            "tokenizer": str(tokenizer.name_or_path),
+            "vocab_size": len(tokenizer),
+            "block_size": self.block_size,
+            "dtype": np.dtype(self.dtype).name,
+            "num_tokens": total,
+            "num_blocks": num_blocks,
+        }
+        # The sidecar is written last, so an interrupted build is redone next time.
+        with open(self.meta_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=4)
+        return meta
+
+    def __len__(self) -> int:
+        return self.num_blocks
+
+    def __getitem__(self, i) -> torch.Tensor:
+        return torch.from_numpy(self.blocks[i].astype(np.int64))
+
 def load_dataset(file_path: str, tokenizer, block_size: int = 128):
-    from transformers import TextDataset
-    return TextDataset(
-        tokenizer=tokenizer,
-        file_path=file_path,
-        block_size=block_size,
-        overwrite_cache=True,
-    )
+    return TokenBlockDataset(file_path, tokenizer, block_size=block_size)
 
 def fine_tune_model(model_name: str, train_file: str, val_file: str, output_dir: str, epochs=3):
     # Load tokenizer
@@ -43,7 +140,7 @@ def fine_tune_model(model_name: str, train_file: str, val_file: str, output_dir:
     training_args = TrainingArguments(
     output_dir=output_dir,
     overwrite_output_dir=True,
-    num_train_epochs=3,
+    num_train_epochs=epochs,
     per_device_train_batch_size=4,
     save_steps=500,
     save_total_limit=2,
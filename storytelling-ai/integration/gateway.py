@@ -0,0 +1,62 @@
+"""
+gateway.py
+
+Serves every API from one process, so all endpoints share a single set of model
+instances (through modules/model_registry) instead of each app loading its own.
+
+The three existing Flask apps are mounted unchanged, each keeping its own routes,
+CORS policy and error handling:
+  - app.py:  /, /generate_images, /donate/images/<filename>
+  - app2.py: /feedback
+  - app3.py: /generate_story, /generate_story/stream, /continue_story, /jobs/...
+A request goes to the first app whose URL map knows its path. /metrics is
+answered by app3, and covers the whole process.
+
+Usage:
+    python integration/gateway.py          # http://127.0.0.1:5000 (GATEWAY_PORT to change)
+    WARMUP_MODELS=1 python integration/gateway.py
+"""
+
+import os
+import sys
+
+# Ensure the project root is in sys.path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.join(current_dir, "..")
+if parent_dir not in sys.path:
+    sys.path.append(parent_dir)
+
+from werkzeug.exceptions import MethodNotAllowed, NotFound
+from werkzeug.routing import RequestRedirect
+
+from integration.app import app as images_app
+from integration.app2 import app as feedback_app
+from integration.app3 import app as story_app
+
+# Checked in order; the images app owns "/" and goes last.
+MOUNTED_APPS = (story_app, feedback_app, images_app)
+
+
+def _owns(app, environ) -> bool:
+    try:
+        app.url_map.bind_to_environ(environ).match()
+    except NotFound:
+        return False
+    except (MethodNotAllowed, RequestRedirect):
+        # The path exists here; let the app answer with its 405 or redirect.
+        return True
+    return True
+
+
+def application(environ, start_response):
+    """WSGI entry point (e.g. gunicorn 'integration.gateway:application')."""
+    for app in MOUNTED_APPS:
+        if _owns(app, environ):
+            return app.wsgi_app(environ, start_response)
+    return NotFound()(environ, start_response)
+
+
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+
+    run_simple("127.0.0.1", int(os.environ.get("GATEWAY_PORT", 5000)), application, threaded=True)
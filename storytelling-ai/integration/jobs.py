@@ -0,0 +1,119 @@
+"""
+jobs.py
+
+A bounded background job queue for the story pipeline.
+
+Jobs run on a fixed-size worker pool. Once all workers are busy and the waiting
+queue is full, new submissions are refused (QueueFullError) instead of piling up
+more concurrent torch work on the CPU. The pool size is the only limit: torch's
+thread settings are process-wide and are left alone, so requests served outside
+the queue keep every core.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class QueueFullError(Exception):
+    """Raised when a job is submitted while the queue is at capacity."""
+
+
+class JobQueue:
+    """
+    Runs event-producing jobs (e.g. pipeline.generate_story_events) on a worker pool.
+
+    Each job is tracked as a dict:
+    {
+      "id": "...",
+      "status": "queued" | "running" | "done" | "error",
+      "partial": {...},   # results of the stages finished so far
+      "result": {...},    # the final result once status is "done"
+      "error": "...",     # the error message once status is "error"
+      "queued_at": float, "started_at": float, "finished_at": float
+    }
+    """
+
+    def __init__(self, job_fn, max_workers: int = 2, max_pending: int = 8, max_finished: int = 500):
+        self.job_fn = job_fn
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self._jobs = OrderedDict()
+        self._active = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="story-job")
+
+    def depth(self) -> int:
+        """Number of jobs that are queued or running."""
+        with self._lock:
+            return self._active
+
+    def submit(self, *args) -> str:
+        """Queues job_fn(*args) and returns the job id; raises QueueFullError at capacity."""
+        with self._lock:
+            if self._active >= self.max_workers + self.max_pending:
+                raise QueueFullError(
+                    f"Job queue is full ({self._active} jobs queued or running)."
+                )
+            job_id = str(uuid.uuid4())
+            self._jobs[job_id] = {
+                "id": job_id,
+                "status": "queued",
+                "partial": {},
+                "result": None,
+                "error": None,
+                "queued_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+            }
+            self._active += 1
+            self._evict_finished()
+        self._executor.submit(self._run, job_id, args)
+        return job_id
+
+    def get(self, job_id: str) -> dict:
+        """Returns a snapshot of the job, or None if the id is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {**job, "partial": dict(job["partial"])}
+
+    def _run(self, job_id: str, args: tuple) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(status="running", started_at=time.time())
+        # Status, result/error and finish time change together, so readers never
+        # see a finished job without its result.
+        outcome = {"status": "error", "error": "Job did not finish."}
+        try:
+            result = None
+            for event in self.job_fn(*args):
+                if event["event"] == "done":
+                    result = event["data"]
+                else:
+                    self._record(job, event)
+            outcome = {"status": "done", "result": result}
+        except Exception as e:
+            outcome = {"status": "error", "error": str(e)}
+        finally:
+            with self._lock:
+                job.update(outcome, finished_at=time.time())
+                self._active -= 1
+
+    def _record(self, job: dict, event: dict) -> None:
+        with self._lock:
+            if event["event"] == "token":
+                job["partial"]["raw_story"] = job["partial"].get("raw_story", "") + event["data"]
+            else:
+                job["partial"][event["event"]] = event["data"]
+
+    def _evict_finished(self) -> None:
+        # Forget the oldest finished jobs once too many are retained.
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
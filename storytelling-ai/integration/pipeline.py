@@ -1,4 +1,5 @@
 import os
+import re
 import sys
 
 # Ensure the project root is in sys.path
@@ -8,13 +9,18 @@ if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
 # -- Import your existing modules --
-from modules.idea_generator import generate_idea
+from modules.idea_generator import generate_idea, get_tokenizer, summarize_texts, IdeaStream, StoryContext
 from modules.dialogue_improver import improve_dialogue
-from modules.character_designer import extract_traits
+from modules.character_designer import update_character_appearances
+from modules.stopping import FirstLine
 from modules.story_manager import (
     update_story_metadata,
     append_story_content,
-    update_character_in_story
+    update_character_in_story,
+    story_content_length,
+    story_content_slice,
+    get_story_summary,
+    set_story_summary,
 )
 
 # ---------------------------------------------------------------------
@@ -34,45 +40,102 @@ def parse_label_output(model_output: str, label: str) -> str:
 # ---------------------------------------------------------------------
 # HELPER FUNCTIONS FOR METADATA EXTRACTION
 # ---------------------------------------------------------------------
+# Every follow-up prompt puts the story first and the instruction after it,
+# so a StoryContext can encode the story once and reuse it for all of them.
 
-def extract_genre_from_story(story_text: str) -> str:
-    prompt = (
-        f"Analyze the following story and determine the most fitting literary genre. "
-        f"Output only the genre:\n\n{story_text}\n\nGenre:"
-    )
-    raw_genre = generate_idea(prompt, max_length=250).strip()
+GENRE_INSTRUCTION = (
+    "\n\nAnalyze the story above and determine the most fitting literary genre. "
+    "Output only the genre.\n\nGenre:"
+)
+PREMISE_INSTRUCTION = (
+    "\n\nAnalyze the story above and summarize its main premise in one or two sentences. "
+    "Output only the premise.\n\nPremise:"
+)
+TITLE_INSTRUCTION = (
+    "\n\nAnalyze the story above and provide a concise, creative title. "
+    "Output only the title.\n\nTitle:"
+)
+
+# Length (prompt included) of a generated story. distilgpt2 sees 1024 positions,
+# which generate_idea enforces anyway; asking for more only hides the real cost.
+STORY_MAX_LENGTH = 1024
+
+# New-token budgets for each follow-up answer.
+GENRE_MAX_NEW_TOKENS = 10
+PREMISE_MAX_NEW_TOKENS = 60
+TITLE_MAX_NEW_TOKENS = 20
+BACKSTORY_MAX_NEW_TOKENS = 150
+
+# Each answer is one line (a genre is a few words), so generation stops there.
+GENRE_STOP = FirstLine(max_words=4)
+PREMISE_STOP = FirstLine()
+TITLE_STOP = FirstLine()
+
+def extract_genre_from_story(story_text: str, context: StoryContext = None) -> str:
+    context = context or StoryContext(story_text)
+    raw_genre = context.generate(GENRE_INSTRUCTION, GENRE_MAX_NEW_TOKENS, GENRE_STOP).strip()
     return parse_label_output(raw_genre, "Genre:")
 
-def extract_premise_from_story(story_text: str) -> str:
-    prompt = (
-        f"Analyze the following story and summarize its main premise in one or two sentences. "
-        f"Output only the premise:\n\n{story_text}\n\nPremise:"
-    )
-    raw_premise = generate_idea(prompt, max_length=600).strip()
+def extract_premise_from_story(story_text: str, context: StoryContext = None) -> str:
+    context = context or StoryContext(story_text)
+    raw_premise = context.generate(PREMISE_INSTRUCTION, PREMISE_MAX_NEW_TOKENS, PREMISE_STOP).strip()
     return parse_label_output(raw_premise, "Premise:")
 
-def extract_title_from_story(story_text: str) -> str:
-    prompt = (
-        f"Analyze the following story and provide a concise, creative title. "
-        f"Output only the title:\n\n{story_text}\n\nTitle:"
-    )
-    raw_title = generate_idea(prompt, max_length=1000).strip()
+def extract_title_from_story(story_text: str, context: StoryContext = None) -> str:
+    context = context or StoryContext(story_text)
+    raw_title = context.generate(TITLE_INSTRUCTION, TITLE_MAX_NEW_TOKENS, TITLE_STOP).strip()
     return parse_label_output(raw_title, "Title:")
 
+def extract_metadata_from_story(story_text: str, context: StoryContext = None) -> tuple:
+    """
+    Extracts (genre, premise, title) in one batch that branches off the cached story prefix.
+    """
+    context = context or StoryContext(story_text)
+    raw_genre, raw_premise, raw_title = context.generate_many(
+        [GENRE_INSTRUCTION, PREMISE_INSTRUCTION, TITLE_INSTRUCTION],
+        [GENRE_MAX_NEW_TOKENS, PREMISE_MAX_NEW_TOKENS, TITLE_MAX_NEW_TOKENS],
+        [GENRE_STOP, PREMISE_STOP, TITLE_STOP],
+    )
+    return (
+        parse_label_output(raw_genre.strip(), "Genre:"),
+        parse_label_output(raw_premise.strip(), "Premise:"),
+        parse_label_output(raw_title.strip(), "Title:"),
+    )
+
 # ---------------------------------------------------------------------
 # HELPER FUNCTION FOR CHARACTER BACKSTORY
 # ---------------------------------------------------------------------
 
-def generate_character_backstory(name: str, full_story_text: str) -> str:
-    prompt = (
-        f"Based on the following story, describe the character named {name} in detail. "
+def backstory_instruction(name: str) -> str:
+    return (
+        f"\n\nBased on the story above, describe the character named {name} in detail. "
         "Include their personality, motivations, and any relevant background hinted at in the story. "
-        "Output only the summary:\n\n"
-        f"{full_story_text}\n\nCharacter Summary:"
+        "Output only the summary.\n\nCharacter Summary:"
     )
-    raw_summary = generate_idea(prompt, max_length=1000).strip()
+
+def generate_character_backstory(name: str, full_story_text: str, context: StoryContext = None) -> str:
+    context = context or StoryContext(full_story_text)
+    raw_summary = context.generate(backstory_instruction(name), BACKSTORY_MAX_NEW_TOKENS).strip()
     return parse_label_output(raw_summary, "Character Summary:")
 
+def generate_character_backstories(names: list, full_story_text: str, context: StoryContext = None) -> dict:
+    """
+    Generates a summary for every character name, sharing one encoding of the story.
+    Returns a dict mapping each name to its summary.
+    """
+    context = context or StoryContext(full_story_text)
+    raw_summaries = context.generate_many(
+        [backstory_instruction(name) for name in names], BACKSTORY_MAX_NEW_TOKENS
+    )
+    return {
+        name: parse_label_output(raw.strip(), "Character Summary:")
+        for name, raw in zip(names, raw_summaries)
+    }
+
+def filter_character_names(traits: list) -> list:
+    # Simple filter: Only consider names starting with an uppercase letter and short names.
+    return [name for name in traits if name[0].isupper() and len(name.split()) <= 3]
+
 # ---------------------------------------------------------------------
 # FUNCTION FOR API INTEGRATION (NON-INTERACTIVE)
 # ---------------------------------------------------------------------
@@ -85,6 +148,7 @@ def generate_story(initial_prompt: str, story_id: str) -> dict:
       - genre: The auto-extracted genre.
       - premise: The auto-extracted premise.
       - story: The improved story text.
+      - story_id: The id it was stored under (to continue it with continue_story).
     
     This function performs:
       1. Initial story generation.
@@ -92,32 +156,147 @@ def generate_story(initial_prompt: str, story_id: str) -> dict:
       3. Dialogue improvement.
       4. Updates the story metadata and content storage.
     
-    Note: This version does not include the interactive expansion loop.
+    Note: This version does not include the interactive expansion loop; use
+    continue_story to extend a stored story.
     """
-    # 1) Generate the initial story
-    raw_generation = generate_idea(initial_prompt, max_length=2000)
+    result = None
+    for event in generate_story_events(initial_prompt, story_id):
+        if event["event"] == "done":
+            result = event["data"]
+    return result
+
+def generate_story_events(initial_prompt: str, story_id: str):
+    """
+    Runs the same steps as generate_story, yielding progress events as they happen:
+      - {"event": "token", "data": "<new story text>"} while the raw story is generated,
+      - {"event": "genre" | "premise" | "title", "data": "..."} after metadata extraction,
+      - {"event": "story", "data": "<improved story>"} after dialogue improvement,
+      - {"event": "done", "data": {title, genre, premise, story, story_id}} once persisted.
+    """
+    # 1) Generate the initial story, streaming the new text as it is decoded
+    stream = IdeaStream(initial_prompt, max_length=STORY_MAX_LENGTH)
+    for piece in stream:
+        yield {"event": "token", "data": piece}
+    raw_generation = stream.text
     print("=== Generated Raw Story ===\n", raw_generation)
 
     # 2) Auto-extract metadata
-    auto_genre = extract_genre_from_story(raw_generation)
-    auto_premise = extract_premise_from_story(raw_generation)
-    auto_title = extract_title_from_story(raw_generation)
+    auto_genre, auto_premise, auto_title = extract_metadata_from_story(raw_generation)
+    yield {"event": "genre", "data": auto_genre}
+    yield {"event": "premise", "data": auto_premise}
+    yield {"event": "title", "data": auto_title}
 
     # 3) Improve the dialogue (remove the prompt so we don't re-apply instructions)
     story_text = raw_generation.replace(initial_prompt, "").strip()
     improved_story = improve_dialogue(story_text)
     print("\n=== Improved Story (Dialogue Enhanced) ===\n", improved_story)
+    yield {"event": "story", "data": improved_story}
 
     # 4) Update story metadata and content (optional persistence)
     update_story_metadata(story_id, title=auto_title, premise=auto_premise, genre=auto_genre)
     append_story_content(story_id, improved_story)
+    update_character_appearances(story_id, improved_story, select=filter_character_names)
 
-    return {
+    yield {"event": "done", "data": {
          "title": auto_title,
          "genre": auto_genre,
          "premise": auto_premise,
-         "story": improved_story
-    }
+         "story": improved_story,
+         "story_id": story_id
+    }}
+
+# ---------------------------------------------------------------------
+# STORY CONTINUATION
+# ---------------------------------------------------------------------
+# A continuation only sees the last CONTINUE_TAIL_TOKENS of the stored story plus
+# a rolling summary of everything before that tail. The summary is stored with
+# the story, and each call folds in only the text that has left the tail since
+# the previous one, so a chapter costs the same however long the story gets.
+
+CONTINUE_TAIL_TOKENS = 384
+CONTINUE_MAX_NEW_TOKENS = 200
+CONTINUE_SUMMARY_TOKENS = 120
+# Text leaving the tail is folded into the summary this many tokens at a time
+# (summary + piece + new summary stay well inside the window).
+SUMMARY_FOLD_TOKENS = 512
+# Characters read back per tail token; generous, so the tail is rarely short.
+TAIL_CHARS_PER_TOKEN = 8
+
+SUMMARY_LABEL = "Summary of the story so far: "
+CONTINUE_INSTRUCTION = "\n\nContinue the story. {instruction}\n\n"
+
+def story_tail(story_id: str, max_tokens: int = CONTINUE_TAIL_TOKENS) -> tuple:
+    """
+    Returns (tail_start, tail): about the last `max_tokens` tokens of the stored
+    content, starting on a word boundary, and their character offset.
+    """
+    tokenizer = get_tokenizer()
+    length = story_content_length(story_id)
+    start = max(0, length - max_tokens * TAIL_CHARS_PER_TOKEN)
+    text = story_content_slice(story_id, start)
+    ids = tokenizer(text).input_ids
+    cut = 0
+    if len(ids) > max_tokens:
+        kept = tokenizer.decode(ids[-max_tokens:], clean_up_tokenization_spaces=False)
+        cut = max(0, len(text) - len(kept))
+    if start + cut > 0 and not text[cut - 1:cut].isspace():
+        boundary = re.compile(r"\s").search(text, cut)
+        cut = boundary.end() if boundary else len(text)
+    return start + cut, text[cut:]
+
+def story_summary(story_id: str, upto: int) -> str:
+    """
+    Summary of content[:upto]. The stored summary is extended with the text it
+    doesn't cover yet, SUMMARY_FOLD_TOKENS at a time, and stored again.
+    """
+    covered, summary = get_story_summary(story_id)
+    if covered > story_content_length(story_id):
+        # The content was replaced since the summary was written.
+        covered, summary = 0, ""
+    if covered >= upto:
+        return summary
+    tokenizer = get_tokenizer()
+    ids = tokenizer(story_content_slice(story_id, covered, upto)).input_ids
+    for i in range(0, len(ids), SUMMARY_FOLD_TOKENS):
+        piece = tokenizer.decode(ids[i:i + SUMMARY_FOLD_TOKENS], clean_up_tokenization_spaces=False)
+        prompt = (summary + "\n" if summary else "") + piece + "\nTL;DR:"
+        summary = summarize_texts([prompt], CONTINUE_SUMMARY_TOKENS)[0]
+    set_story_summary(story_id, upto, summary)
+    return summary
+
+class StoryNotFound(Exception):
+    """Raised by continue_story when the story doesn't exist or has no content."""
+
+def continue_story(story_id: str, instruction: str, max_new_tokens: int = CONTINUE_MAX_NEW_TOKENS) -> dict:
+    """
+    Writes the next part of a stored story, following `instruction`.
+
+    The prompt is the rolling summary of the earlier story, the recent tail and the
+    instruction. The new text has its dialogue improved, is appended to the story
+    and its characters' appearances are recorded.
+
+    Returns a dict with story_id, text (the appended part) and characters (the
+    character names found in it). Raises StoryNotFound if the story has no content.
+    """
+    if story_content_length(story_id) == 0:
+        raise StoryNotFound(f"Story {story_id!r} has no content to continue.")
+    tail_start, tail = story_tail(story_id)
+    summary = story_summary(story_id, tail_start)
+    prompt = (SUMMARY_LABEL + summary + "\n\n" if summary else "") + tail \
+        + CONTINUE_INSTRUCTION.format(instruction=instruction.strip())
+
+    prompt_tokens = len(get_tokenizer()(prompt).input_ids)
+    raw_generation = generate_idea(prompt, max_length=prompt_tokens + max_new_tokens)
+    new_text = raw_generation[len(prompt):] if raw_generation.startswith(prompt) \
+        else raw_generation.rpartition(instruction.strip())[2]
+    new_text = new_text.strip()
+
+    improved_text, char_names = "", []
+    if new_text:
+        improved_text = improve_dialogue(new_text)
+        append_story_content(story_id, improved_text)
+        char_names = list(update_character_appearances(story_id, improved_text, select=filter_character_names))
+    return {"story_id": story_id, "text": improved_text, "characters": char_names}
 
 # ---------------------------------------------------------------------
 # LEGACY INTERACTIVE PIPELINE (WITH EXPANSION LOOP)
@@ -134,13 +313,11 @@ def run_pipeline(initial_prompt: str, story_id: str):
     This function runs in an interactive mode via the CLI.
     """
     # 1) Generate the initial story
-    raw_generation = generate_idea(initial_prompt, max_length=2000)
+    raw_generation = generate_idea(initial_prompt, max_length=STORY_MAX_LENGTH)
     print("=== Generated Raw Story ===\n", raw_generation)
 
     # 2) Auto-extract metadata
-    auto_genre = extract_genre_from_story(raw_generation)
-    auto_premise = extract_premise_from_story(raw_generation)
-    auto_title = extract_title_from_story(raw_generation)
+    auto_genre, auto_premise, auto_title = extract_metadata_from_story(raw_generation)
 
     # 3) Improve the dialogue (remove the prompt so we don't re-apply instructions)
     story_text = raw_generation.replace(initial_prompt, "").strip()
@@ -151,13 +328,10 @@ def run_pipeline(initial_prompt: str, story_id: str):
     update_story_metadata(story_id, title=auto_title, premise=auto_premise, genre=auto_genre)
     append_story_content(story_id, improved_story)
 
-    # 5) Extract characters and update their backstories
-    traits = extract_traits(improved_story)
-    for char_name in traits:
-        # Simple filter: Only consider names starting with an uppercase letter and short names.
-        if not char_name[0].isupper() or len(char_name.split()) > 3:
-            continue
-        char_backstory = generate_character_backstory(char_name, improved_story)
+    # 5) Extract characters (with where they appear) and update their backstories
+    char_names = list(update_character_appearances(story_id, improved_story, select=filter_character_names))
+    backstories = generate_character_backstories(char_names, improved_story)
+    for char_name, char_backstory in backstories.items():
         update_character_in_story(story_id, char_name, personality=char_backstory, backstory=char_backstory)
 
     # 6) Interactive Expansion Loop
@@ -166,16 +340,14 @@ def run_pipeline(initial_prompt: str, story_id: str):
         expansion_prompt = input("\nEnter an additional prompt to expand the story (or press enter to finish): ")
         if not expansion_prompt.strip():
             break
-        additional_raw = generate_idea(expansion_prompt, max_length=2000)
-        additional_improved = improve_dialogue(additional_raw)
-        print("\n=== Expanded, Improved Text ===\n", additional_improved)
-        full_story_so_far += "\n" + additional_improved
-        append_story_content(story_id, additional_improved)
-        traits = extract_traits(full_story_so_far)
-        for char_name in traits:
-            if not char_name[0].isupper() or len(char_name.split()) > 3:
-                continue
-            char_backstory = generate_character_backstory(char_name, full_story_so_far)
+        # Conditions on the recent tail plus a summary of the rest, and stores the new part.
+        continuation = continue_story(story_id, expansion_prompt)
+        print("\n=== Expanded, Improved Text ===\n", continuation["text"])
+        full_story_so_far += "\n" + continuation["text"]
+        # Only the appended text is re-extracted; backstories are refreshed for the characters in it.
+        char_names = continuation["characters"]
+        backstories = generate_character_backstories(char_names, full_story_so_far)
+        for char_name, char_backstory in backstories.items():
             update_character_in_story(story_id, char_name, personality=char_backstory, backstory=char_backstory)
 
 if __name__ == "__main__":
@@ -0,0 +1,179 @@
+"""
+batch_scheduler.py
+
+Merges generation requests that arrive at about the same time on different
+threads (concurrent /feedback and /generate_story requests) into one batched
+model call, instead of each thread running its own generate on the shared model.
+
+A caller submits its rows and blocks. A single worker thread takes the oldest
+waiting request, keeps collecting for up to GENERATION_BATCH_WINDOW_MS (default
+10) or until GENERATION_BATCH_MAX_SIZE rows (default 8) are waiting, runs them
+through the batch function in one go and hands every caller its own results.
+Only requests of the same group (e.g. greedy vs sampled decoding) share a batch.
+
+Statistics are kept per scheduler (stats()) and recorded as the
+generation_batch_size and generation_queue_wait_seconds histograms.
+Set GENERATION_BATCHING=0 to run every request directly on its caller's thread.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+try:
+    from modules import metrics
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+
+ENABLED = os.environ.get("GENERATION_BATCHING", "1") != "0"
+WINDOW_MS = float(os.environ.get("GENERATION_BATCH_WINDOW_MS", 10))
+MAX_BATCH_SIZE = int(os.environ.get("GENERATION_BATCH_MAX_SIZE", 8))
+
+metrics.set_buckets("generation_batch_size", (1, 2, 4, 8, 16, 32, 64))
+metrics.describe("generation_batch_size", "Rows per batched generate call")
+metrics.describe("generation_queue_wait_seconds", "Time a request waited before its batch started")
+
+
+class _Request:
+    __slots__ = ("rows", "group", "enqueued", "done", "results", "error")
+
+    def __init__(self, rows: list, group):
+        self.rows = rows
+        self.group = group
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Runs `run_batch(rows, group)` over rows collected from concurrent submit() calls.
+
+    run_batch must return one result per row, in order. A single request with more
+    than `max_batch_size` rows is run as one batch of its own (it is never split).
+    """
+
+    def __init__(self, name: str, run_batch, window_ms: float = WINDOW_MS,
+                 max_batch_size: int = MAX_BATCH_SIZE, enabled: bool = ENABLED):
+        self.name = name
+        self.run_batch = run_batch
+        self.window = window_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.enabled = enabled
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self._batches = 0
+        self._requests = 0
+        self._rows = 0
+        self._largest_batch = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        metrics.register_gauge(
+            "generation_queue_depth", _queue_depths, "Requests waiting for a batched generate call"
+        )
+        _schedulers[name] = self
+
+    def submit(self, rows: list, group=None) -> list:
+        """Queues `rows` and blocks until their results are ready; returns them in order."""
+        if not rows:
+            return []
+        if not self.enabled or threading.current_thread() is self._thread:
+            return list(self.run_batch(rows, group))
+        request = _Request(list(rows), group)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._worker, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+            self._queue.append(request)
+            self._cond.notify()
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.results
+
+    def _waiting_rows(self, group) -> int:
+        return sum(len(request.rows) for request in self._queue if request.group == group)
+
+    def _take(self, group) -> list:
+        """Removes the requests of `group` that fit in one batch, oldest first."""
+        batch, size, kept = [], 0, deque()
+        for request in self._queue:
+            if request.group == group and (not batch or size + len(request.rows) <= self.max_batch_size):
+                batch.append(request)
+                size += len(request.rows)
+            else:
+                kept.append(request)
+        self._queue = kept
+        return batch
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                oldest = self._queue[0]
+                deadline = oldest.enqueued + self.window
+                while self._waiting_rows(oldest.group) < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take(oldest.group)
+            self._run(batch)
+
+    def _run(self, batch: list) -> None:
+        rows = [row for request in batch for row in request.rows]
+        started = time.perf_counter()
+        waits = [started - request.enqueued for request in batch]
+        for wait in waits:
+            metrics.observe("generation_queue_wait_seconds", wait, scheduler=self.name)
+        metrics.observe("generation_batch_size", len(rows), scheduler=self.name)
+        with self._stats_lock:
+            self._batches += 1
+            self._requests += len(batch)
+            self._rows += len(rows)
+            self._largest_batch = max(self._largest_batch, len(rows))
+            self._wait_total += sum(waits)
+            self._wait_max = max([self._wait_max] + waits)
+
+        try:
+            results = list(self.run_batch(rows, batch[0].group))
+        except Exception as e:
+            for request in batch:
+                request.error = e
+                request.done.set()
+            return
+        start = 0
+        for request in batch:
+            request.results = results[start:start + len(request.rows)]
+            start += len(request.rows)
+            request.done.set()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return len(self._queue)
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "batches": self._batches,
+                "requests": self._requests,
+                "rows": self._rows,
+                "mean_batch_size": round(self._rows / self._batches, 2) if self._batches else 0.0,
+                "max_batch_size": self._largest_batch,
+                "mean_queue_wait_ms": round(self._wait_total / self._requests * 1000, 2) if self._requests else 0.0,
+                "max_queue_wait_ms": round(self._wait_max * 1000, 2),
+                "queue_depth": self.queue_depth(),
+            }
+
+
+_schedulers = {}
+
+
+def _queue_depths() -> dict:
+    return {(("scheduler", name),): scheduler.queue_depth() for name, scheduler in list(_schedulers.items())}
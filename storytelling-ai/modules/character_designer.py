@@ -1,17 +1,113 @@
 #character_designer.py
-import spacy
+"""
+character_designer.py
 
-# Load spaCy English model (ensure you've run: python -m spacy download en_core_web_sm)
-nlp = spacy.load("en_core_web_sm")
+Finds character names in story text with spaCy named-entity recognition.
+
+Only the NER part of en_core_web_sm is loaded (see model_registry), texts are
+processed in batches through nlp.pipe, and every entity keeps its character
+offsets so the story store can record where a character first and last appears.
+"""
+
+import os
+
+try:
+    from modules import model_registry, story_manager
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import model_registry
+    import story_manager
+
+# Entity labels treated as characters.
+CHARACTER_LABELS = ("PERSON", "ORG")
+# Paragraphs per nlp.pipe batch.
+NER_BATCH_SIZE = int(os.environ.get("NER_BATCH_SIZE", 64))
+
+def _paragraph_spans(text: str) -> list:
+    """Splits text on newlines into (offset, paragraph) pairs, skipping blank lines."""
+    spans, start = [], 0
+    for line in text.split("\n"):
+        if line.strip():
+            spans.append((start, line))
+        start += len(line) + 1
+    return spans
+
+def extract_entities_batch(texts: list, labels=CHARACTER_LABELS) -> list:
+    """
+    Runs NER over several texts in one nlp.pipe stream. Long texts are split into
+    paragraphs so the batches stay evenly sized.
+
+    Returns:
+        list: For each text, its entities in document order as
+        {"text", "label", "start", "end"} dicts (offsets into that text).
+    """
+    nlp = model_registry.get("spacy")
+    paragraphs = [(i, offset, paragraph) for i, text in enumerate(texts)
+                  for offset, paragraph in _paragraph_spans(text)]
+    results = [[] for _ in texts]
+    docs = nlp.pipe((paragraph for _, _, paragraph in paragraphs), batch_size=NER_BATCH_SIZE)
+    for (i, offset, _), doc in zip(paragraphs, docs):
+        results[i].extend(
+            {"text": ent.text, "label": ent.label_,
+             "start": offset + ent.start_char, "end": offset + ent.end_char}
+            for ent in doc.ents if ent.label_ in labels
+        )
+    return results
+
+def extract_entities(text: str, labels=CHARACTER_LABELS) -> list:
+    """Character entities of a single text, with offsets; see extract_entities_batch."""
+    return extract_entities_batch([text], labels)[0]
 
 def extract_traits(text):
     """
     Extracts potential character names from the text using named-entity recognition.
     For example, entities with labels 'PERSON' or 'ORG' are considered as character traits.
+    Names are unique and ordered by first appearance.
     """
-    doc = nlp(text)
-    traits = [ent.text for ent in doc.ents if ent.label_ in ["PERSON", "ORG"]]
-    return list(set(traits))
+    return list(dict.fromkeys(entity["text"] for entity in extract_entities(text)))
+
+def character_appearances(entities: list, offset: int = 0) -> dict:
+    """Maps each entity name to (first, last) start offsets of its mentions, shifted by `offset`."""
+    appearances = {}
+    for entity in entities:
+        start = entity["start"] + offset
+        first, _ = appearances.get(entity["text"], (start, start))
+        appearances[entity["text"]] = (first, start)
+    return appearances
+
+def update_character_appearances(story_id: str, new_text: str, select=None) -> dict:
+    """
+    Records where characters appear in `new_text`, which must be the content just
+    appended to `story_id`. Only the new text is run through NER: offsets are shifted
+    to the end of the stored content, characters seen for the first time get both
+    first_appearance and last_appearance, and known characters only move their
+    last_appearance forward.
+
+    Args:
+        story_id (str): The story the text was appended to.
+        new_text (str): The appended text.
+        select (callable): Optional filter applied to the list of names found.
+
+    Returns:
+        dict: {name: (first, last)} offsets into the story content, for the names recorded.
+    """
+    # The new text is always the last chunk of the stored content.
+    offset = max(story_manager.story_content_length(story_id) - len(new_text), 0)
+    characters = story_manager.get_story_characters(story_id)
+    appearances = character_appearances(extract_entities(new_text), offset)
+    names = select(list(appearances)) if select else list(appearances)
+
+    recorded = {}
+    for name in names:
+        first, last = appearances[name]
+        known = characters.get(name, {}).get("first_appearance", "")
+        if known != "":
+            first = int(known)
+            story_manager.record_character_appearance(story_id, name, last_appearance=last)
+        else:
+            story_manager.record_character_appearance(story_id, name, first_appearance=first, last_appearance=last)
+        recorded[name] = (first, last)
+    return recorded
 
 '''
 import spacy
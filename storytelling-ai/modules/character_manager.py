@@ -14,6 +14,12 @@ For example, you might keep only:
 import json
 import difflib
 
+try:
+    from modules.stopping import JsonObject
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    from stopping import JsonObject
+
 def extract_json(text: str) -> dict:
     """
     Attempts to extract a JSON object from the given text.
@@ -39,6 +45,9 @@ def auto_update_character(name: str, context: str, generate_idea_fn) -> Tuple[st
     Example function that uses 'generate_idea_fn' to produce a
     JSON with 'personality' and 'backstory' keys for a given character.
     Returns (personality, backstory) strings.
+
+    generate_idea_fn is called like idea_generator.generate_idea, with a stop
+    condition that ends generation once the JSON object is closed.
     """
     prompt = (
         f"Generate a JSON object with two keys: 'personality' and 'backstory'. "
@@ -46,7 +55,7 @@ def auto_update_character(name: str, context: str, generate_idea_fn) -> Tuple[st
         f"{context}\n\n"
         "Output ONLY the JSON object, with no extra text."
     )
-    output = generate_idea_fn(prompt, max_length=400).strip()
+    output = generate_idea_fn(prompt, max_length=400, stop=JsonObject()).strip()
     details = extract_json(output)
 
     if details is None:
@@ -0,0 +1,130 @@
+"""
+context_budget.py
+
+Keeps every generation call inside the model's context window (1024 positions
+for distilgpt2 and DialoGPT).
+
+Token counts always come from the model's own tokenizer. When a prompt plus its
+requested new tokens would not fit:
+- the new-token budget is capped to what the window leaves, and
+- the prompt is cut down to its own budget. A prompt can always claim at least
+  half of the window, so a long story never leaves too little room for the answer
+  and a long answer never squeezes the story to nothing.
+
+Prompts are cut by token ids, never by characters. Continuations keep the end
+of their prompt (truncate_ids). Stories that are asked about as a whole keep
+their beginning and end (fit_ids), with one of two strategies for the middle:
+- "truncate" drops it,
+- "summarize" replaces it with a short model-written summary ("TL;DR:").
+
+The default strategy comes from CONTEXT_STRATEGY.
+"""
+
+import os
+
+try:
+    from modules import metrics
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+
+DEFAULT_WINDOW = 1024
+CONTEXT_STRATEGY = os.environ.get("CONTEXT_STRATEGY", "truncate")
+# Marker put where the middle of a story was cut out (head_tail) or summarised.
+ELISION = "\n...\n"
+# Token budget for each summarised piece of the dropped middle.
+SUMMARY_TOKENS = 60
+
+
+def context_window(model) -> int:
+    """Number of positions the model can attend to."""
+    config = getattr(model, "config", None)
+    for attribute in ("n_positions", "max_position_embeddings"):
+        value = getattr(config, attribute, None)
+        if isinstance(value, int) and value > 0:
+            return value
+    return DEFAULT_WINDOW
+
+
+def count_tokens(tokenizer, text: str) -> int:
+    return len(tokenizer(text).input_ids)
+
+
+def plan(prompt_tokens: int, max_new_tokens: int, window: int) -> tuple:
+    """
+    Splits the window between a prompt and its answer.
+
+    Returns:
+        tuple: (prompt_budget, new_tokens). new_tokens is at most max_new_tokens,
+        and prompt_budget + new_tokens never exceeds the window.
+    """
+    max_new_tokens = max(int(max_new_tokens), 1)
+    new_tokens = min(max_new_tokens, window - min(prompt_tokens, window // 2))
+    return window - new_tokens, new_tokens
+
+
+def truncate_ids(ids: list, budget: int, keep: str = "tail") -> list:
+    """Cuts a list of token ids down to `budget`, keeping the tail or the head and tail."""
+    if len(ids) <= budget:
+        return ids
+    if budget <= 0:
+        return []
+    if keep == "tail":
+        return ids[-budget:]
+    head = budget // 3
+    return ids[:head] + ids[len(ids) - (budget - head):]
+
+
+def fit_ids(tokenizer, ids: list, budget: int, strategy: str = None, summarize_fn=None, stage: str = "",
+            window: int = DEFAULT_WINDOW) -> list:
+    """
+    Returns token `ids` cut to at most `budget` tokens, keeping their beginning and end.
+
+    Args:
+        strategy (str): "truncate" or "summarize" (default: CONTEXT_STRATEGY).
+        summarize_fn (callable): summarize_fn(texts, max_new_tokens) -> list of summaries,
+            required for the "summarize" strategy.
+        stage (str): Label for the truncation counter in /metrics.
+        window (int): Context window of the summarising model.
+    """
+    ids = list(ids)
+    if len(ids) <= budget:
+        return ids
+    metrics.inc("context_truncations_total", stage=stage or "unknown")
+    strategy = strategy or CONTEXT_STRATEGY
+    elision_ids = tokenizer(ELISION).input_ids
+    if budget <= 4 * len(elision_ids):
+        return truncate_ids(ids, budget)
+
+    head = budget // 3
+    tail = budget - head - len(elision_ids)
+    if strategy == "summarize" and summarize_fn is not None:
+        # Give the summary a quarter of the budget, taken from the tail.
+        summary_budget = tail // 4
+        tail -= summary_budget + len(elision_ids)
+        summary = summarize_middle(tokenizer, ids[head:len(ids) - tail], summary_budget, summarize_fn, window)
+        summary_ids = tokenizer(summary).input_ids[:summary_budget]
+        return ids[:head] + elision_ids + summary_ids + elision_ids + ids[len(ids) - tail:]
+    return ids[:head] + elision_ids + ids[len(ids) - tail:]
+
+
+def fit_text(tokenizer, text: str, budget: int, **kwargs) -> str:
+    """Like fit_ids, for text; returns `text` itself when it already fits."""
+    ids = tokenizer(text).input_ids
+    if len(ids) <= budget:
+        return text
+    return tokenizer.decode(fit_ids(tokenizer, ids, budget, **kwargs), clean_up_tokenization_spaces=False)
+
+
+def summarize_middle(tokenizer, ids: list, summary_budget: int, summarize_fn, window: int = DEFAULT_WINDOW) -> str:
+    """
+    Summarises a run of token ids piece by piece (each piece fits the window together
+    with its summary) and joins the summaries.
+    """
+    piece_tokens = window - SUMMARY_TOKENS - 16
+    pieces = [ids[i:i + piece_tokens] for i in range(0, len(ids), piece_tokens)]
+    per_piece = max(min(SUMMARY_TOKENS, summary_budget // len(pieces)), 8)
+    prompts = [tokenizer.decode(piece, clean_up_tokenization_spaces=False) + "\nTL;DR:" for piece in pieces]
+    with metrics.timer("context_summary_seconds"):
+        summaries = summarize_fn(prompts, per_piece)
+    return " ".join(summary.strip() for summary in summaries)
@@ -3,27 +3,197 @@
 dialogue_improver.py
 
 Uses a DialoGPT model to improve or rewrite a piece of dialogue.
+
+Long texts are rewritten in paragraph chunks: each chunk is sent as the latest
+turn of a conversation whose previous turn is the end of the chunk before it,
+all chunks are decoded together as one left-padded batch, and each chunk is
+followed by its rewrite in the original order, line breaks included. Latency
+then follows the longest chunk instead of the whole story. Both modes return
+the text with the model's reply after it (after each chunk when chunked).
 """
 
-from transformers import AutoModelForCausalLM, AutoTokenizer
+import os
+import re
+
 import torch
 
-# Using DialoGPT-medium for quality (use DialoGPT-small if you prefer speed).
-TOKENIZER = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
-MODEL = AutoModelForCausalLM.from_pretrained("microsoft/DialoGPT-medium")
+try:
+    from modules import metrics, model_registry
+    from modules.context_budget import context_window, plan, truncate_ids
+    from modules.generation_cache import get_cache, is_sampling, make_key, model_revision
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+    import model_registry
+    from context_budget import context_window, plan, truncate_ids
+    from generation_cache import get_cache, is_sampling, make_key, model_revision
 
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-MODEL.to(DEVICE)
+# Maximum tokens per chunk; paragraphs are packed together up to this size.
+DIALOGUE_CHUNK_TOKENS = int(os.environ.get("DIALOGUE_CHUNK_TOKENS", 200))
+# Tokens from the end of the previous chunk given as conversational context.
+DIALOGUE_CONTEXT_TOKENS = int(os.environ.get("DIALOGUE_CONTEXT_TOKENS", 48))
+# Chunks decoded together in one generate call.
+DIALOGUE_BATCH_SIZE = int(os.environ.get("DIALOGUE_BATCH_SIZE", 16))
 
-def improve_dialogue(dialogue: str, max_length: int = 1000) -> str:
+def improve_dialogue(dialogue: str, max_length: int = 1000, chunked: bool = None, do_sample: bool = False) -> str:
     """
     Rewrite/improve the given dialogue or story text using DialoGPT.
+
+    The output stays within DialoGPT's context window: the new-token budget is capped
+    to the room left after the input, and an input too long to leave room keeps only
+    its end (see context_budget.plan). Greedy results are memoised in the generation cache.
+
+    Args:
+        dialogue (str): The text to rewrite.
+        max_length (int): Maximum token length (input included) in single-pass mode.
+        chunked (bool): Rewrite paragraph chunks in a batch (see improve_dialogue_chunked).
+            By default only texts longer than one chunk are chunked.
+        do_sample (bool): Sample instead of decoding greedily (bypasses the cache).
     """
-    input_ids = TOKENIZER.encode(dialogue + TOKENIZER.eos_token, return_tensors="pt").to(DEVICE)
-    outputs = MODEL.generate(
-        input_ids,
-        max_length=max_length,
-        pad_token_id=TOKENIZER.eos_token_id
-    )
-    improved = TOKENIZER.decode(outputs[0], skip_special_tokens=True)
+    # DialoGPT-medium is loaded once per process, on first use.
+    tokenizer, model = model_registry.get("dialogpt")
+    ids = tokenizer.encode(dialogue + tokenizer.eos_token)
+    if chunked is None:
+        chunked = len(ids) > DIALOGUE_CHUNK_TOKENS
+
+    cache = None if is_sampling(model, do_sample=do_sample) else get_cache()
+    if cache is not None:
+        params = (
+            # "layout" keeps entries from before chunks kept their own text out of the disk cache.
+            {"chunk_tokens": DIALOGUE_CHUNK_TOKENS, "context_tokens": DIALOGUE_CONTEXT_TOKENS, "layout": 2}
+            if chunked else {"max_length": max_length}
+        )
+        key = make_key(model_revision("dialogpt", model), dialogue, chunked=chunked, **params)
+        improved = cache.get(key)
+        if improved is not None:
+            return improved
+
+    if chunked:
+        improved = improve_dialogue_chunked(dialogue, do_sample=do_sample)
+    else:
+        improved = _improve_single(tokenizer, model, ids, max_length, do_sample)
+    if cache is not None:
+        cache.put(key, improved)
+    return improved
+
+def _improve_single(tokenizer, model, ids: list, max_length: int, do_sample: bool) -> str:
+    prompt_budget, new_tokens = plan(len(ids), max_length - len(ids), context_window(model))
+    if len(ids) > prompt_budget:
+        metrics.inc("context_truncations_total", stage="improve_dialogue")
+    input_ids = torch.tensor([truncate_ids(ids, prompt_budget)], dtype=torch.long, device=model.device)
+    with metrics.timer("generate_seconds", model="dialogpt", stage="improve_dialogue"):
+        outputs = model.generate(
+            input_ids,
+            attention_mask=torch.ones_like(input_ids),
+            max_new_tokens=new_tokens,
+            pad_token_id=tokenizer.eos_token_id,
+            do_sample=do_sample,
+        )
+    if metrics.ENABLED:
+        metrics.record_tokens("dialogpt", input_ids.shape[1], [outputs[0, input_ids.shape[1]:]], tokenizer.eos_token_id)
+    improved = tokenizer.decode(outputs[0], skip_special_tokens=True)
     return improved
+
+def split_chunks(tokenizer, text: str, max_tokens: int = DIALOGUE_CHUNK_TOKENS) -> list:
+    """
+    Splits `text` into consecutive chunks of at most `max_tokens` tokens, packing its
+    paragraphs (lines) in order. A single paragraph longer than that is split on token
+    boundaries. Each chunk starts with the line breaks before it (the last one also
+    keeps the text's trailing whitespace), so "".join(chunks) gives `text` back.
+    """
+    # The current chunk is text[start:end] and holds current_tokens tokens.
+    chunks, start, end, current_tokens = [], 0, 0, 0
+    for match in re.finditer(r"[^\n]+", text):
+        paragraph = match.group()
+        if not paragraph.strip():
+            continue
+        ids = tokenizer.encode(paragraph)
+        if len(ids) > max_tokens:
+            if current_tokens:
+                chunks.append(text[start:end])
+                start = end
+            pieces = [tokenizer.decode(ids[i:i + max_tokens]) for i in range(0, len(ids), max_tokens)]
+            pieces[0] = text[start:match.start()] + pieces[0]
+            chunks.extend(pieces)
+            start = end = match.end()
+            current_tokens = 0
+            continue
+        # Joining onto the current chunk also costs the line breaks in between.
+        cost = len(ids) + (len(tokenizer.encode(text[end:match.start()])) if current_tokens else 0)
+        if current_tokens and current_tokens + cost > max_tokens:
+            chunks.append(text[start:end])
+            start = end
+            cost = len(ids)
+        current_tokens += cost
+        end = match.end()
+    if current_tokens:
+        chunks.append(text[start:])
+    elif chunks:
+        chunks[-1] += text[start:]
+    return chunks
+
+def improve_dialogue_chunked(
+    text: str,
+    chunk_tokens: int = DIALOGUE_CHUNK_TOKENS,
+    context_tokens: int = DIALOGUE_CONTEXT_TOKENS,
+    batch_size: int = DIALOGUE_BATCH_SIZE,
+    do_sample: bool = False,
+) -> str:
+    """
+    Rewrites `text` chunk by chunk with DialoGPT and returns each chunk followed by its
+    rewrite, in the original order and with the original line breaks, the same layout
+    as a single pass gives for the whole text.
+
+    Each chunk is the current turn, preceded by the last `context_tokens` tokens of
+    the previous chunk as the earlier turn. Chunks are generated `batch_size` at a time
+    as one padded batch, each with a budget of about 1.5x its own length. A chunk the
+    model answers with nothing is kept on its own.
+    """
+    tokenizer, model = model_registry.get("dialogpt")
+    window = context_window(model)
+    eos = tokenizer.eos_token_id
+    chunks = split_chunks(tokenizer, text, chunk_tokens)
+    if not chunks:
+        return text
+    chunk_ids = [tokenizer.encode(chunk.strip()) for chunk in chunks]
+
+    prompts, budgets = [], []
+    for i, ids in enumerate(chunk_ids):
+        context = chunk_ids[i - 1][-context_tokens:] + [eos] if i > 0 and context_tokens > 0 else []
+        prompt = context + ids + [eos]
+        prompt_budget, new_tokens = plan(len(prompt), len(ids) * 3 // 2 + 16, window)
+        prompts.append(truncate_ids(prompt, prompt_budget))
+        budgets.append(new_tokens)
+
+    rewrites = []
+    for start in range(0, len(prompts), batch_size):
+        rewrites.extend(_generate_batch(
+            tokenizer, model, prompts[start:start + batch_size], budgets[start:start + batch_size], window,
+            do_sample,
+        ))
+    return "".join(chunk + rewrite for chunk, rewrite in zip(chunks, rewrites))
+
+def _generate_batch(tokenizer, model, prompts: list, budgets: list, window: int, do_sample: bool = False) -> list:
+    """Generates the responses (new text only) for left-padded prompt ids in one call."""
+    eos = tokenizer.eos_token_id
+    padded_length = max(len(ids) for ids in prompts)
+    input_ids = torch.full((len(prompts), padded_length), eos, dtype=torch.long)
+    attention_mask = torch.zeros((len(prompts), padded_length), dtype=torch.long)
+    for row, ids in enumerate(prompts):
+        input_ids[row, padded_length - len(ids):] = torch.tensor(ids)
+        attention_mask[row, padded_length - len(ids):] = 1
+    # No row may run past the window, so the longest prompt bounds the whole batch.
+    max_new_tokens = min(max(budgets), window - padded_length)
+
+    with metrics.timer("generate_seconds", model="dialogpt", stage="improve_dialogue_chunked"):
+        outputs = model.generate(
+            input_ids.to(model.device),
+            attention_mask=attention_mask.to(model.device),
+            max_new_tokens=max_new_tokens,
+            pad_token_id=eos,
+            do_sample=do_sample,
+        )
+    new_rows = [output[padded_length:padded_length + budget] for output, budget in zip(outputs, budgets)]
+    if metrics.ENABLED:
+        metrics.record_tokens("dialogpt", sum(len(ids) for ids in prompts), new_rows, eos)
+    return [tokenizer.decode(row, skip_special_tokens=True) for row in new_rows]
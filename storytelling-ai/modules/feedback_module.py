@@ -9,63 +9,182 @@ Provides feedback on text by:
 
 This version returns a dictionary for easy integration with a Flask API and,
 when run directly, prints formatted output.
+
+The analyses run concurrently with per-analysis timeouts, and their results are
+memoised per text, so re-posting an unchanged draft returns immediately.
 """
 
-import language_tool_python
-from transformers import pipeline
+import hashlib
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 try:
-    from modules.idea_generator import generate_idea
+    from modules import metrics, model_registry
+    from modules.context_budget import fit_text
+    from modules.idea_generator import generate_ideas, get_tokenizer, summarize_texts
+    from modules.lru_cache import LRUCache, MISSING
+    from modules.stopping import FirstLine, Lines
 except ModuleNotFoundError:
     # Fallback if your project structure differs
-    from idea_generator import generate_idea
+    import metrics
+    import model_registry
+    from context_budget import fit_text
+    from idea_generator import generate_ideas, get_tokenizer, summarize_texts
+    from lru_cache import LRUCache, MISSING
+    from stopping import FirstLine, Lines
+
+# LanguageTool (US English) and the DistilBERT sentiment pipeline are loaded
+# through the model registry the first time they are needed.
+
+# LanguageTool matches per paragraph, keyed on a hash of the paragraph text.
+_paragraph_matches_cache = LRUCache(max_entries=4096)
+metrics.register_cache("grammar_paragraphs", _paragraph_matches_cache.stats)
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def split_paragraphs(text: str) -> list:
+    """Splits text on blank lines; returns (offset, paragraph) pairs."""
+    paragraphs, start = [], 0
+    for match in PARAGRAPH_BREAK.finditer(text):
+        if match.start() > start:
+            paragraphs.append((start, text[start:match.start()]))
+        start = match.end()
+    if start < len(text):
+        paragraphs.append((start, text[start:]))
+    return paragraphs
+
+def _match_to_dict(match) -> dict:
+    return {
+        "offset": match.offset,
+        "length": match.errorLength,
+        "ruleId": match.ruleId,
+        "message": match.message,
+        "replacements": list(match.replacements),
+    }
+
+def grammar_matches(text: str, incremental: bool = True) -> list:
+    """
+    Checks grammar and spelling using LanguageTool and returns the matches as dicts
+    with offsets into `text`.
+
+    In incremental mode the text is checked paragraph by paragraph: matches are
+    cached per paragraph hash, only new or edited paragraphs are sent to
+    LanguageTool, and offsets are mapped back into the full document. Each
+    paragraph is checked on its own, so its cached matches never depend on (or
+    run into) the paragraphs around it.
+    """
+    tool = model_registry.get("languagetool")
+    if not incremental:
+        with metrics.timer("languagetool_seconds"):
+            return [_match_to_dict(match) for match in tool.check(text)]
+
+    paragraphs = split_paragraphs(text)
+    keys = [hashlib.sha256(paragraph.encode("utf-8")).hexdigest() for _, paragraph in paragraphs]
+    per_paragraph = [_paragraph_matches_cache.get(key, None) for key in keys]
 
-# Initialize LanguageTool for US English.
-tool = language_tool_python.LanguageTool('en-US')
+    for i, matches in enumerate(per_paragraph):
+        if matches is None:
+            with metrics.timer("languagetool_seconds"):
+                matches = [_match_to_dict(match) for match in tool.check(paragraphs[i][1])]
+            _paragraph_matches_cache.put(keys[i], matches)
+            per_paragraph[i] = matches
 
-# Initialize a sentiment analysis pipeline.
-sentiment_pipeline = pipeline(
-    "sentiment-analysis",
-    model="distilbert-base-uncased-finetuned-sst-2-english"
-)
+    matches = []
+    for (offset, _), paragraph_matches in zip(paragraphs, per_paragraph):
+        matches.extend({**match, "offset": match["offset"] + offset} for match in paragraph_matches)
+    return matches
 
-def grammar_feedback(text: str) -> list:
+def grammar_feedback(text: str, incremental: bool = True) -> list:
     """Checks grammar and spelling using LanguageTool."""
-    matches = tool.check(text)
+    matches = grammar_matches(text, incremental)
     corrections = [
-        f"- {match.ruleId}: {match.replacements[0]}" if match.replacements else f"- {match.message}"
+        f"- {match['ruleId']}: {match['replacements'][0]}" if match["replacements"] else f"- {match['message']}"
         for match in matches
     ]
     return corrections
 
+# Tokens per tone section (DistilBERT accepts at most 512, including [CLS]/[SEP]).
+TONE_CHUNK_TOKENS = int(os.environ.get("TONE_CHUNK_TOKENS", 256))
+TONE_BATCH_SIZE = 8
+
+def split_token_chunks(text: str, tokenizer, max_tokens: int = TONE_CHUNK_TOKENS) -> list:
+    """
+    Splits text into consecutive sections of at most max_tokens tokens.
+    Returns (start, end) character spans.
+    """
+    offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+    if not offsets:
+        return [(0, len(text))]
+    spans = []
+    for i in range(0, len(offsets), max_tokens):
+        window = offsets[i:i + max_tokens]
+        spans.append((window[0][0], window[-1][1]))
+    return spans
+
+def tone_curve(text: str) -> dict:
+    """
+    Analyzes the sentiment of each token-bounded section of the text (run through the
+    pipeline in batches) and aggregates them, weighted by section length:
+    {
+      "label": "POSITIVE" | "NEGATIVE", "score": float,
+      "sections": [{"start": int, "end": int, "label": str, "score": float}, ...]
+    }
+    """
+    sentiment_pipeline = model_registry.get("sentiment")
+    spans = split_token_chunks(text, sentiment_pipeline.tokenizer)
+    chunks = [text[start:end] for start, end in spans]
+    with metrics.timer("sentiment_seconds"):
+        predictions = sentiment_pipeline(chunks, batch_size=TONE_BATCH_SIZE, truncation=True)
+
+    sections, weighted_positive, total_weight = [], 0.0, 0
+    for (start, end), prediction in zip(spans, predictions):
+        sections.append({"start": start, "end": end, "label": prediction["label"], "score": prediction["score"]})
+        # Probability that the section is positive, weighted by its length.
+        positive = prediction["score"] if prediction["label"] == "POSITIVE" else 1 - prediction["score"]
+        weight = max(end - start, 1)
+        weighted_positive += positive * weight
+        total_weight += weight
+
+    positive = weighted_positive / total_weight
+    label = "POSITIVE" if positive >= 0.5 else "NEGATIVE"
+    return {
+        "label": label,
+        "score": positive if label == "POSITIVE" else 1 - positive,
+        "sections": sections,
+    }
+
+def format_tone(tone: dict) -> str:
+    return f"{tone['label']} (Confidence: {tone['score']:.2%})"
+
 def tone_check(text: str) -> str:
     """Analyzes the sentiment of the text and returns a readable output."""
-    sentiment = sentiment_pipeline(text)[0]
-    return f"{sentiment['label']} (Confidence: {sentiment['score']:.2%})"
+    return format_tone(tone_curve(text))
 
-def suggest_title(text: str) -> str:
-    """Generates a concise, creative title for the story in one sentence."""
-    prompt = (
+def title_prompt(text: str) -> str:
+    return (
         "Provide a concise, creative title for the following story in one sentence. "
         "Only return the title with no extra commentary.\n\n"
         f"{text}\n\nTitle:"
     )
-    # Use a shorter max_length to reduce extraneous output.
-    title = generate_idea(prompt, max_length=400).strip()
-    # If the returned text still includes the prompt, extract the portion after 'Title:'
-    if "Title:" in title:
-        title = title.split("Title:")[-1].strip()
-    return title.split('\n')[0].strip()
 
-def suggest_twists(text: str) -> list:
-    """Generates three unique and surprising plot twists for the story."""
-    prompt = (
+def twists_prompt(text: str) -> str:
+    return (
         "List three surprising and unique plot twists for the following story. "
         "Return only three bullet points (each starting with a dash) with no extra commentary.\n\n"
         f"{text}\n\nPlot Twists:"
     )
-    # Use a shorter max_length to avoid including too much prompt text.
-    twists_output = generate_idea(prompt, max_length=400).strip()
+
+def parse_title(title: str) -> str:
+    title = title.strip()
+    # If the returned text still includes the prompt, extract the portion after 'Title:'
+    if "Title:" in title:
+        title = title.split("Title:")[-1].strip()
+    return title.split('\n')[0].strip()
+
+def parse_twists(twists_output: str) -> list:
+    twists_output = twists_output.strip()
     # If the output still contains part of the prompt, remove it by finding the first dash.
     if '-' in twists_output:
         first_dash = twists_output.find('-')
@@ -78,27 +197,144 @@ def suggest_twists(text: str) -> list:
         twists_lines = [f"- {part}" for part in parts]
     return twists_lines[:3]
 
+# Story tokens kept in the title/twist prompts, so the 400-token outputs always
+# leave room for the answer (longer stories keep their beginning and end).
+SUGGESTION_STORY_TOKENS = 300
+# parse_title keeps only the first line and parse_twists the first three lines,
+# so generation stops once those are complete.
+TITLE_STOP = FirstLine()
+TWISTS_STOP = Lines(3, marker="-")
+
+def fit_story(text: str) -> str:
+    return fit_text(get_tokenizer(), text, SUGGESTION_STORY_TOKENS, summarize_fn=summarize_texts, stage="suggestions")
+
+def suggest_title(text: str) -> str:
+    """Generates a concise, creative title for the story in one sentence."""
+    # Use a shorter max_length to reduce extraneous output.
+    return parse_title(generate_ideas([title_prompt(fit_story(text))], 400, stop=TITLE_STOP)[0])
+
+def suggest_twists(text: str) -> list:
+    """Generates three unique and surprising plot twists for the story."""
+    # Use a shorter max_length to avoid including too much prompt text.
+    return parse_twists(generate_ideas([twists_prompt(fit_story(text))], 400, stop=TWISTS_STOP)[0])
+
+def suggest_title_and_twists(text: str) -> tuple:
+    """Generates the title and the plot twists in one batched generate call."""
+    text = fit_story(text)
+    raw_title, raw_twists = generate_ideas(
+        [title_prompt(text), twists_prompt(text)], 400, stop=[TITLE_STOP, TWISTS_STOP]
+    )
+    return parse_title(raw_title), parse_twists(raw_twists)
+
+# ---------------------------------------------------------------------
+# CONCURRENT, MEMOISED FEEDBACK
+# ---------------------------------------------------------------------
+
+# Seconds each analysis may take, from when it starts running, before feedback() returns without it.
+ANALYSIS_TIMEOUTS = {
+    "grammar_issues": float(os.environ.get("FEEDBACK_GRAMMAR_TIMEOUT", 30)),
+    "tone": float(os.environ.get("FEEDBACK_TONE_TIMEOUT", 30)),
+    "suggestions": float(os.environ.get("FEEDBACK_SUGGESTIONS_TIMEOUT", 120)),
+}
+# Extra seconds an analysis may wait in the queue (behind other requests') on top of
+# its own timeout, counted from when feedback() was called, before it is given up.
+ANALYSIS_QUEUE_GRACE = float(os.environ.get("FEEDBACK_QUEUE_GRACE", 10))
+# Value reported for an analysis that failed or timed out.
+ANALYSIS_FALLBACKS = {"grammar_issues": [], "tone": None, "suggestions": ("", [])}
+
+# Title and plot twists share one batched distilgpt2 call ("suggestions"), so
+# the two generations don't compete with each other for the CPU.
+ANALYSES = {
+    "grammar_issues": lambda text: grammar_feedback(text),
+    "tone": lambda text: tone_curve(text),
+    "suggestions": lambda text: suggest_title_and_twists(text),
+}
+
+# feedback() calls expected at once; each runs all its analyses in parallel.
+FEEDBACK_CONCURRENCY = int(os.environ.get("FEEDBACK_CONCURRENCY", 4))
+_executor = ThreadPoolExecutor(max_workers=len(ANALYSES) * FEEDBACK_CONCURRENCY, thread_name_prefix="feedback")
+# Keyed on (analysis name, sha256 of the text).
+_results_cache = LRUCache(max_entries=512)
+metrics.register_cache("feedback_results", _results_cache.stats)
+
+def _run_analysis(name: str, text: str, key: tuple, started: dict, running: threading.Event):
+    start = time.perf_counter()
+    started[name] = start
+    running.set()
+    result = ANALYSES[name](text)
+    # Cache even if the caller already gave up waiting, so a retry is instant.
+    _results_cache.put(key, result)
+    elapsed = time.perf_counter() - start
+    metrics.observe("feedback_analysis_seconds", elapsed, analysis=name)
+    return result, elapsed
+
 def feedback(text: str) -> dict:
     """
     Returns a dictionary of feedback for the given text:
     {
       "grammar_issues": [...],
       "tone": "...",
+      "tone_sections": [{"start", "end", "label", "score"}, ...],
       "title": "...",
-      "plot_twists": [ ... ]
+      "plot_twists": [ ... ],
+      "timings": {"grammar_issues": seconds, "tone": seconds, "suggestions": seconds},
+      "cached": [names of analyses served from the cache],
+      "errors": {name: message}   # only analyses that failed or timed out
     }
     """
-    grammar_issues = grammar_feedback(text)
-    tone_result = tone_check(text)
-    title = suggest_title(text)
-    twists = suggest_twists(text)
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    results, timings, cached, errors, futures = {}, {}, [], {}, {}
+    # When each analysis started running, and an event set at that moment.
+    started, running = {}, {}
 
-    return {
-        "grammar_issues": grammar_issues,
-        "tone": tone_result,
+    start = time.perf_counter()
+    for name in ANALYSES:
+        key = (name, digest)
+        value = _results_cache.get(key)
+        if value is not MISSING:
+            results[name] = value
+            timings[name] = 0.0
+            cached.append(name)
+        else:
+            running[name] = threading.Event()
+            futures[name] = _executor.submit(_run_analysis, name, text, key, started, running[name])
+
+    for name, future in futures.items():
+        # Timeouts count from when each analysis starts running, so time spent queued
+        # behind other requests' analyses doesn't count against it; an analysis still
+        # queued this long after feedback() was called is given up instead.
+        queue_deadline = start + ANALYSIS_TIMEOUTS[name] + ANALYSIS_QUEUE_GRACE
+        if not running[name].wait(max(0.0, queue_deadline - time.perf_counter())):
+            future.cancel()
+            errors[name] = "queued too long"
+        else:
+            remaining = max(0.0, ANALYSIS_TIMEOUTS[name] - (time.perf_counter() - started[name]))
+            try:
+                results[name], elapsed = future.result(timeout=remaining)
+                timings[name] = round(elapsed, 3)
+            except FutureTimeoutError:
+                errors[name] = f"timed out after {ANALYSIS_TIMEOUTS[name]:.0f}s"
+            except Exception as e:
+                errors[name] = str(e)
+        if name in errors:
+            metrics.inc("feedback_analysis_errors_total", analysis=name)
+            results[name] = ANALYSIS_FALLBACKS[name]
+            # Like successful timings, measured from when the analysis started running.
+            timings[name] = round(time.perf_counter() - started.get(name, start), 3)
+
+    title, twists = results["suggestions"]
+    response = {
+        "grammar_issues": results["grammar_issues"],
+        "tone": format_tone(results["tone"]) if results["tone"] else "",
+        "tone_sections": results["tone"]["sections"] if results["tone"] else [],
         "title": title,
-        "plot_twists": twists
+        "plot_twists": twists,
+        "timings": timings,
+        "cached": cached,
     }
+    if errors:
+        response["errors"] = errors
+    return response
 
 if __name__ == "__main__":
     print("\n🔍 Paste your story below and press Enter (type 'END' on a new line to finish):\n")
@@ -0,0 +1,199 @@
+"""
+generation_cache.py
+
+Memoises deterministic (greedy) generations.
+
+With greedy decoding the same model, prompt and decoding parameters always give
+the same output, so repeated feedback requests, re-run pipelines and retried jobs
+can reuse earlier results. Two tiers:
+
+- an in-process LRU bounded by GENERATION_CACHE_MB of text (default 64), and
+- an optional SQLite file (GENERATION_CACHE_DB, e.g. data/generation_cache.db)
+  shared by every process and kept across restarts, bounded by
+  GENERATION_CACHE_DISK_MB (default 512); least recently used rows are evicted.
+
+Keys cover the model revision (name or path, hub commit and inference backend),
+the prompt and every decoding parameter. Sampled generations are never cached.
+Set GENERATION_CACHE=0 to turn the cache off.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+try:
+    from modules import metrics
+    from modules.inference_backends import selected_backend
+    from modules.lru_cache import LRUCache, MISSING
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+    from inference_backends import selected_backend
+    from lru_cache import LRUCache, MISSING
+
+ENABLED = os.environ.get("GENERATION_CACHE", "1") != "0"
+MEMORY_MAX_MB = float(os.environ.get("GENERATION_CACHE_MB", 64))
+DISK_PATH = os.environ.get("GENERATION_CACHE_DB", "")
+DISK_MAX_MB = float(os.environ.get("GENERATION_CACHE_DISK_MB", 512))
+# Rows touched on disk are given a new access time at most this often (seconds).
+DISK_TOUCH_INTERVAL = 60
+
+
+def model_revision(name: str, model) -> str:
+    """Identifies the exact weights and backend a model generates with."""
+    config = getattr(model, "config", None)
+    path = getattr(config, "_name_or_path", "") or ""
+    commit = getattr(config, "_commit_hash", "") or ""
+    return f"{name}|{path}|{commit}|{selected_backend()}"
+
+
+def is_sampling(model, **generate_kwargs) -> bool:
+    """True if a generate call with these arguments would sample rather than decode greedily."""
+    if "do_sample" in generate_kwargs and generate_kwargs["do_sample"] is not None:
+        return bool(generate_kwargs["do_sample"])
+    generation_config = getattr(model, "generation_config", None)
+    return bool(getattr(generation_config, "do_sample", False))
+
+
+def make_key(revision: str, prompt, **params) -> str:
+    """sha256 over the model revision, the prompt (text or token ids) and the decoding parameters."""
+    payload = json.dumps([revision, prompt, params], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskTier:
+    """Generations stored in a SQLite file, evicted least recently used past `max_bytes`."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS generations (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            last_access REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS generations_last_access ON generations (last_access);
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        conn = self._conn()
+        row = conn.execute("SELECT value, last_access FROM generations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[1] > DISK_TOUCH_INTERVAL:
+            conn.execute("UPDATE generations SET last_access = ? WHERE key = ?", (now, key))
+        return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        conn = self._conn()
+        size = len(value.encode("utf-8"))
+        conn.execute(
+            "INSERT OR REPLACE INTO generations (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+            (key, value, size, time.time()),
+        )
+        self._evict(conn)
+
+    def _evict(self, conn) -> None:
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        for key, size in conn.execute("SELECT key, size FROM generations ORDER BY last_access").fetchall():
+            if freed >= excess:
+                break
+            conn.execute("DELETE FROM generations WHERE key = ?", (key,))
+            freed += size
+
+    def stats(self) -> dict:
+        entries, size = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes}
+
+
+class GenerationCache:
+    """The in-process LRU in front of the optional disk tier."""
+
+    def __init__(self, memory_max_bytes: int, disk_path: str = "", disk_max_bytes: int = 0):
+        self.memory = LRUCache(
+            max_entries=1_000_000, max_bytes=memory_max_bytes, sizeof=lambda value: len(value.encode("utf-8"))
+        )
+        self.disk = DiskTier(disk_path, disk_max_bytes) if disk_path else None
+        self.disk_hits = 0
+
+    def get(self, key: str):
+        """Returns the cached text for `key`, or None."""
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+        if self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.disk_hits += 1
+                self.memory.put(key, value)
+                return value
+        return None
+
+    def put(self, key: str, value: str) -> None:
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def clear(self) -> None:
+        """Clears the in-process tier (the disk tier is left alone)."""
+        self.memory.clear()
+
+    def stats(self) -> dict:
+        memory = self.memory.stats()
+        # Lookups that missed memory but hit disk count as hits overall.
+        hits = memory["hits"] + self.disk_hits
+        lookups = memory["hits"] + memory["misses"]
+        stats = {
+            "entries": memory["entries"],
+            "bytes": memory["bytes"],
+            "memory_hits": memory["hits"],
+            "disk_hits": self.disk_hits,
+            "hits": hits,
+            "misses": lookups - hits,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache() -> GenerationCache:
+    """The process-wide generation cache (None when GENERATION_CACHE=0)."""
+    global _cache
+    if not ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = GenerationCache(int(MEMORY_MAX_MB * 2**20), DISK_PATH, int(DISK_MAX_MB * 2**20))
+                metrics.register_cache("generation", _cache.stats)
+    return _cache
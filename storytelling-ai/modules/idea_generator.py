@@ -2,47 +2,505 @@
 idea_generator.py
 
 Generates a story idea or prompt using a fine-tuned GPT-2 model.
+
+With ASSISTED_DECODING=1, generate_idea / generate_ideas decode with a larger
+GPT-2 family model ("gpt2_target" in the model registry, ASSISTED_TARGET_MODEL)
+using assisted (speculative) decoding: distilgpt2 drafts a few tokens, the target
+verifies them in one forward pass and keeps the ones it agrees with. Greedy
+outputs are the target's own, at a fraction of its per-token cost when the draft
+is accepted often. Assisted decoding runs one sequence at a time and needs the
+fp32 or int8 backend (with INFERENCE_BACKEND=onnx, model_registry refuses to
+import). StoryContext always uses distilgpt2.
+
+ASSISTED_DRAFT_TOKENS sets how many tokens a draft round starts with (transformers
+then grows or shrinks it with the acceptance rate) and ASSISTED_CONFIDENCE the
+draft probability below which a round ends early; unset, transformers' defaults apply.
 """
-from transformers import GPT2LMHeadModel, GPT2Tokenizer
+import copy
+import os
+import threading
+
 import torch
+from transformers import StoppingCriteriaList, TextIteratorStreamer
+
+try:
+    from modules import metrics, model_registry
+    from modules.batch_scheduler import MicroBatcher
+    from modules.context_budget import context_window, fit_ids, plan, truncate_ids
+    from modules.generation_cache import get_cache, is_sampling, make_key, model_revision
+    from modules.stopping import Cancelled, StopCriteria, cache_params
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+    import model_registry
+    from batch_scheduler import MicroBatcher
+    from context_budget import context_window, fit_ids, plan, truncate_ids
+    from generation_cache import get_cache, is_sampling, make_key, model_revision
+    from stopping import Cancelled, StopCriteria, cache_params
 
-# Use distilgpt2 for faster inference.
-TOKENIZER = GPT2Tokenizer.from_pretrained("distilgpt2")
-# Set pad_token to eos_token if not already set.
-if TOKENIZER.pad_token is None:
-    TOKENIZER.pad_token = TOKENIZER.eos_token
+ASSISTED_DECODING = model_registry.ASSISTED_DECODING
+ASSISTED_DRAFT_TOKENS = int(os.environ["ASSISTED_DRAFT_TOKENS"]) if os.environ.get("ASSISTED_DRAFT_TOKENS") else None
+ASSISTED_CONFIDENCE = float(os.environ["ASSISTED_CONFIDENCE"]) if os.environ.get("ASSISTED_CONFIDENCE") else None
 
-MODEL = GPT2LMHeadModel.from_pretrained("distilgpt2")
+def get_tokenizer():
+    """The shared distilgpt2 tokenizer (loaded on first use)."""
+    return model_registry.get("distilgpt2")[0]
 
-# Move model to GPU if available.
-DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-MODEL.to(DEVICE)
+def get_model():
+    """The shared distilgpt2 model (loaded on first use)."""
+    return model_registry.get("distilgpt2")[1]
 
-def generate_idea(prompt: str, max_length: int = 300) -> str:
+def _generator() -> tuple:
+    """
+    (name, tokenizer, model, assistant_model) that generate_ideas decodes with:
+    distilgpt2 alone, or the target with distilgpt2 as its draft model. Both share
+    GPT-2's vocabulary, so distilgpt2's tokenizer serves either.
+    """
+    tokenizer, draft = model_registry.get("distilgpt2")
+    if not ASSISTED_DECODING:
+        return "distilgpt2", tokenizer, draft, None
+    # transformers reads the draft settings from the draft model's generation config.
+    if ASSISTED_DRAFT_TOKENS is not None:
+        draft.generation_config.num_assistant_tokens = ASSISTED_DRAFT_TOKENS
+    if ASSISTED_CONFIDENCE is not None:
+        draft.generation_config.assistant_confidence_threshold = ASSISTED_CONFIDENCE
+    return "gpt2_target", tokenizer, model_registry.get("gpt2_target")[1], draft
+
+def generate_idea(prompt: str, max_length: int = 300, do_sample: bool = False, stop=None) -> str:
     """
     Generate a story idea or prompt.
 
     Args:
         prompt (str): The input prompt.
         max_length (int): Maximum token length for the generated output.
+        do_sample (bool): Sample instead of decoding greedily (never cached).
+        stop: Optional stop condition from modules/stopping.py; generation ends as soon
+            as the part the caller keeps is complete.
 
     Returns:
         str: The generated story idea.
     """
-    inputs = TOKENIZER(prompt, return_tensors="pt", padding=True).to(DEVICE)
-    outputs = MODEL.generate(
-        inputs.input_ids,
-        attention_mask=inputs.attention_mask,
-        max_length=max_length,
-        num_return_sequences=1,
-        no_repeat_ngram_size=2,
-        pad_token_id=TOKENIZER.pad_token_id,
-    )
-    idea = TOKENIZER.decode(outputs[0], skip_special_tokens=True)
-    return idea
+    return generate_ideas([prompt], max_length, do_sample=do_sample, stop=stop)[0]
+
+def generate_ideas(prompts: list, max_lengths=300, streamer=None, do_sample: bool = False, stop=None,
+                   cancel=None) -> list:
+    """
+    Generate outputs for several prompts in one batched generate call.
+
+    Outputs never exceed the model's context window: the new-token budget is capped
+    to the room left after the prompt, and a prompt too long to leave room for its
+    answer keeps only its end (see context_budget.plan).
+
+    Greedy outputs are memoised in the generation cache; only prompts that miss it
+    are generated. A streamed call always generates (so tokens can be streamed) but
+    still stores its result.
+
+    Unstreamed prompts are queued on the shared batch scheduler, so concurrent
+    callers on other threads are generated together in one padded batch.
+
+    Args:
+        prompts (list): The input prompts.
+        max_lengths (int | list): Maximum token length (prompt included) for every
+            output, or one value per prompt.
+        streamer: Optional transformers streamer (single prompt only).
+        do_sample (bool): Sample instead of decoding greedily (bypasses the cache).
+        stop: Optional stop condition (see modules/stopping.py) for every prompt, or
+            one per prompt (None for no condition).
+        cancel: Optional threading.Event for a streamed call; once set, generation
+            stops after the current token and the partial text is returned (not cached).
+
+    Returns:
+        list: The generated texts, in the same order as ``prompts``.
+    """
+    if not prompts:
+        return []
+    if isinstance(max_lengths, int):
+        max_lengths = [max_lengths] * len(prompts)
+    stops = stop if isinstance(stop, (list, tuple)) else [stop] * len(prompts)
+    name, _, model, _ = _generator()
+
+    cache = None if is_sampling(model, do_sample=do_sample) else get_cache()
+    results = [None] * len(prompts)
+    keys = [None] * len(prompts)
+    if cache is not None:
+        for i, (prompt, max_len) in enumerate(zip(prompts, max_lengths)):
+            keys[i] = _cache_key(name, model, prompt, max_len, stops[i])
+            if streamer is None:
+                results[i] = cache.get(keys[i])
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if pending:
+        if streamer is None:
+            rows = _batcher.submit(
+                [(prompts[i], max_lengths[i], stops[i]) for i in pending], group=bool(do_sample)
+            )
+            texts, complete = zip(*rows)
+        else:
+            texts, complete = _generate_batch(
+                [prompts[i] for i in pending], [max_lengths[i] for i in pending], streamer, do_sample,
+                [stops[i] for i in pending], cancel,
+            )
+        for i, text, is_complete in zip(pending, texts, complete):
+            results[i] = text
+            # A row whose budget was cut short by a longer prompt in the batch isn't
+            # what the same call alone would return, so it isn't cached.
+            if cache is not None and is_complete:
+                cache.put(keys[i], text)
+    return results
+
+def _cache_key(name: str, model, prompt: str, max_length: int, stop=None) -> str:
+    # With assisted decoding greedy outputs are the target's, so the draft isn't part of the key.
+    return make_key(model_revision(name, model), prompt, max_length=max_length, no_repeat_ngram_size=2,
+                    **cache_params(stop))
+
+def cached_idea(prompt: str, max_length: int = 300) -> str:
+    """What generate_idea(prompt, max_length) returned before, if it is still cached (else None)."""
+    name, _, model, _ = _generator()
+    cache = None if is_sampling(model) else get_cache()
+    return cache.get(_cache_key(name, model, prompt, max_length)) if cache is not None else None
+
+def _generate_batch(prompts: list, max_lengths: list, streamer=None, do_sample: bool = False, stops=None,
+                    cancel=None) -> tuple:
+    """
+    One batched generate call. Returns (texts, complete), where complete[i] is False
+    if row i got fewer new tokens than it would have on its own.
+    """
+    prompt_ids, new_tokens = _plan_rows(prompts, max_lengths)
+    return _generate_planned(prompt_ids, new_tokens, streamer, do_sample, stops, cancel)
+
+def _plan_rows(prompts: list, max_lengths: list) -> tuple:
+    """Tokenises the prompts and fits each into the window; returns (prompt_ids, new_tokens)."""
+    _, tokenizer, model, _ = _generator()
+    window = context_window(model)
+    prompt_ids, new_tokens = [], []
+    for ids, max_len in zip(tokenizer(prompts).input_ids, max_lengths):
+        prompt_budget, budget = plan(len(ids), max_len - len(ids), window)
+        if len(ids) > prompt_budget:
+            metrics.inc("context_truncations_total", stage="generate_idea")
+        prompt_ids.append(truncate_ids(ids, prompt_budget))
+        new_tokens.append(budget)
+    return prompt_ids, new_tokens
+
+def _generate_planned(prompt_ids: list, new_tokens: list, streamer=None, do_sample: bool = False,
+                      stops=None, cancel=None) -> tuple:
+    name, tokenizer, model, assistant = _generator()
+    if assistant is not None and len(prompt_ids) > 1:
+        # Assisted generation decodes one sequence at a time.
+        rows = [
+            _generate_planned([ids], [budget], streamer, do_sample, [stops[row]] if stops else None, cancel)
+            for row, (ids, budget) in enumerate(zip(prompt_ids, new_tokens))
+        ]
+        return [texts[0] for texts, _ in rows], [complete[0] for _, complete in rows]
+    window = context_window(model)
+    prompt_lengths = [len(ids) for ids in prompt_ids]
+    padded_length = max(prompt_lengths)
+    # Left-pad so every prompt ends where generation starts.
+    input_ids = torch.full((len(prompt_ids), padded_length), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(prompt_ids), padded_length), dtype=torch.long)
+    for row, ids in enumerate(prompt_ids):
+        if ids:
+            input_ids[row, padded_length - len(ids):] = torch.tensor(ids)
+            attention_mask[row, padded_length - len(ids):] = 1
+    input_ids, attention_mask = input_ids.to(model.device), attention_mask.to(model.device)
+    # Each prompt keeps its own budget; the batch only runs as long as the largest one,
+    # and no row may run past the window, so the longest prompt bounds the whole batch.
+    batch_new_tokens = min(max(new_tokens), window - max(prompt_lengths))
+    complete = [budget <= batch_new_tokens for budget in new_tokens]
+    new_tokens = [min(budget, batch_new_tokens) for budget in new_tokens]
+    criteria = StopCriteria(tokenizer, stops, padded_length) if stops and any(stops) else None
+    stopping = StoppingCriteriaList([criteria] if criteria else [])
+    if cancel is not None:
+        stopping.append(Cancelled(cancel))
+
+    with metrics.timer("generate_seconds", model=name, stage="generate_idea"):
+        outputs = model.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            assistant_model=assistant,
+            max_new_tokens=batch_new_tokens,
+            num_return_sequences=1,
+            no_repeat_ngram_size=2,
+            pad_token_id=tokenizer.pad_token_id,
+            streamer=streamer,
+            do_sample=do_sample,
+            stopping_criteria=stopping,
+        )
+    if cancel is not None and cancel.is_set():
+        # Cut short by the caller, so no row is what an uncancelled call returns.
+        complete = [False] * len(prompt_ids)
+    if metrics.ENABLED:
+        metrics.record_tokens(name, sum(prompt_lengths), [
+            output[padded_length:padded_length + budget] for output, budget in zip(outputs, new_tokens)
+        ], tokenizer.pad_token_id)
+    texts = [
+        tokenizer.decode(output[:padded_length + budget], skip_special_tokens=True)
+        for output, budget in zip(outputs, new_tokens)
+    ]
+    if criteria is not None:
+        for row, stop in enumerate(stops):
+            if criteria.done[row]:
+                prompt_text = tokenizer.decode(outputs[row][:padded_length], skip_special_tokens=True)
+                if texts[row].startswith(prompt_text):
+                    new_text = texts[row][len(prompt_text):]
+                    end = stop.end(new_text)
+                    if end is not None:
+                        texts[row] = prompt_text + new_text[:end]
+                        # Complete within its own budget, so a cap from the batch didn't matter.
+                        complete[row] = True
+    return texts, complete
+
+def _generate_scheduled(rows: list, do_sample: bool) -> list:
+    """
+    Batch function of the scheduler: rows are (prompt, max_length, stop) triples from
+    any number of callers; returns one (text, complete) pair per row.
+
+    Rows are split into groups whose longest prompt still leaves every row its full
+    budget, so no caller's output is cut short by another caller's prompt.
+    """
+    prompt_ids, new_tokens = _plan_rows([row[0] for row in rows], [row[1] for row in rows])
+    window = context_window(get_model())
+    groups = []  # [row indices, longest prompt, largest budget]
+    for i, (ids, budget) in enumerate(zip(prompt_ids, new_tokens)):
+        for group in groups:
+            if max(group[1], len(ids)) + max(group[2], budget) <= window:
+                group[0].append(i)
+                group[1], group[2] = max(group[1], len(ids)), max(group[2], budget)
+                break
+        else:
+            groups.append([[i], len(ids), budget])
+
+    results = [None] * len(rows)
+    for indices, _, _ in groups:
+        texts, complete = _generate_planned(
+            [prompt_ids[i] for i in indices], [new_tokens[i] for i in indices], do_sample=do_sample,
+            stops=[rows[i][2] for i in indices],
+        )
+        for i, text, is_complete in zip(indices, texts, complete):
+            results[i] = (text, is_complete)
+    return results
+
+# Shared by every thread that calls generate_idea / generate_ideas.
+_batcher = MicroBatcher("generate_idea", _generate_scheduled)
+
+def batch_stats() -> dict:
+    """Batch-size and queue-wait statistics of the generate_idea scheduler."""
+    return _batcher.stats()
+
+def summarize_texts(texts: list, max_new_tokens: int) -> list:
+    """Short summaries of several texts (each already ending in "TL;DR:"), generated in one batch."""
+    tokenizer = get_tokenizer()
+    lengths = [len(ids) + max_new_tokens for ids in tokenizer(texts).input_ids]
+    return [output.rpartition("TL;DR:")[2].strip() for output in generate_ideas(texts, lengths)]
+
+
+class IdeaStream:
+    """
+    Runs generate_idea in a background thread and yields the new text as it is decoded.
+
+    Once iteration finishes, ``text`` holds exactly what generate_idea would have returned.
+    If the consumer stops iterating early (e.g. a streaming client disconnected),
+    generation is cancelled after the current token instead of running to max_length.
+    """
+
+    def __init__(self, prompt: str, max_length: int = 300):
+        self.prompt = prompt
+        self.max_length = max_length
+        self.text = None
+        self._error = None
+        self._cancel = threading.Event()
+
+    def _run(self, streamer):
+        try:
+            self.text = generate_ideas([self.prompt], self.max_length, streamer=streamer, cancel=self._cancel)[0]
+        except Exception as e:
+            self._error = e
+            # Unblock the consumer if generation failed before finishing the stream.
+            streamer.end()
+
+    def __iter__(self):
+        cached = cached_idea(self.prompt, self.max_length)
+        if cached is not None:
+            # Replay a cached generation as a single piece.
+            self.text = cached
+            piece = cached[len(self.prompt):] if cached.startswith(self.prompt) else cached
+            if piece:
+                yield piece
+            return
+        streamer = TextIteratorStreamer(get_tokenizer(), skip_prompt=True, skip_special_tokens=True)
+        thread = threading.Thread(target=self._run, args=(streamer,), daemon=True)
+        thread.start()
+        finished = False
+        try:
+            for piece in streamer:
+                if piece:
+                    yield piece
+            finished = True
+        finally:
+            # Also reached through GeneratorExit when the consumer abandons the stream.
+            if not finished:
+                self._cancel.set()
+            thread.join()
+        if self._error is not None:
+            raise self._error
+
+# Window positions a StoryContext keeps free after the story for instructions and answers.
+STORY_RESERVE_TOKENS = 256
+
+class StoryContext:
+    """
+    Encodes a story once and answers follow-up instructions from its cached state.
+
+    Prompts are laid out as ``story + instruction``, so the story is a shared prefix:
+    its past_key_values are computed once and every instruction only has to prefill
+    its own suffix tokens.
+
+    The story is fitted to the context window minus ``reserve_tokens`` (room for the
+    instructions and their answers), keeping its beginning and end; with the
+    "summarize" strategy the cut middle is replaced by a generated summary.
+    """
+
+    def __init__(self, story_text: str, reserve_tokens: int = STORY_RESERVE_TOKENS, strategy: str = None):
+        self.tokenizer, self.model = model_registry.get("distilgpt2")
+        self.window = context_window(self.model)
+        story_ids = fit_ids(
+            self.tokenizer, self.tokenizer(story_text).input_ids, self.window - reserve_tokens,
+            strategy=strategy, summarize_fn=summarize_texts, stage="story_context", window=self.window,
+        )
+        self.prefix_ids = torch.tensor([story_ids], dtype=torch.long, device=self.model.device)
+        self.past_key_values = None
+        self._encoded = False
+        self._story_digest = make_key("story", story_ids)
+
+    def _encode_prefix(self) -> None:
+        # Runs on the first cache miss, so fully cached instructions never encode the story.
+        if self._encoded:
+            return
+        self._encoded = True
+        if self.prefix_ids.shape[1] > 0:
+            metrics.inc("prompt_tokens_total", self.prefix_ids.shape[1], model="distilgpt2")
+            with torch.no_grad():
+                self.past_key_values = self.model(self.prefix_ids, use_cache=True).past_key_values
+
+    def _expanded_cache(self, batch_size: int):
+        # generate() extends the cache in place, so every call works on its own copy.
+        cache = copy.deepcopy(self.past_key_values)
+        if batch_size == 1:
+            return cache
+        if hasattr(cache, "batch_repeat_interleave"):
+            cache.batch_repeat_interleave(batch_size)
+            return cache
+        return tuple(
+            tuple(tensor.repeat_interleave(batch_size, dim=0) for tensor in layer)
+            for layer in cache
+        )
+
+    def generate(self, instruction: str, max_new_tokens: int = 100, stop=None) -> str:
+        """Generate the continuation of ``story + instruction`` (new text only)."""
+        return self.generate_many([instruction], max_new_tokens, stop)[0]
+
+    def generate_many(self, instructions: list, max_new_tokens=100, stop=None) -> list:
+        """
+        Generate continuations for several instructions in one batch off the cached prefix.
+
+        Suffixes are left-padded *between* the prefix and the instruction; the padding is
+        masked out, so each row sees exactly ``story + instruction``.
+
+        Args:
+            instructions (list): Instruction suffixes appended after the story.
+            max_new_tokens (int | list): New-token budget for all rows, or one per row.
+            stop: Optional stop condition (see modules/stopping.py) for all rows, or one per row.
+
+        Returns:
+            list: The generated text for each instruction (prompt excluded), in order.
+        """
+        if not instructions:
+            return []
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * len(instructions)
+        stops = stop if isinstance(stop, (list, tuple)) else [stop] * len(instructions)
+
+        cache = None if is_sampling(self.model) else get_cache()
+        results, keys = [None] * len(instructions), [None] * len(instructions)
+        if cache is not None:
+            revision = model_revision("distilgpt2", self.model)
+            for i, (instruction, budget) in enumerate(zip(instructions, max_new_tokens)):
+                keys[i] = make_key(revision, [self._story_digest, instruction],
+                                   max_new_tokens=budget, no_repeat_ngram_size=2, **cache_params(stops[i]))
+                results[i] = cache.get(keys[i])
+
+        pending = [i for i, result in enumerate(results) if result is None]
+        if pending:
+            texts, complete = self._generate_rows(
+                [instructions[i] for i in pending], [max_new_tokens[i] for i in pending],
+                [stops[i] for i in pending],
+            )
+            for i, text, is_complete in zip(pending, texts, complete):
+                results[i] = text
+                if cache is not None and is_complete:
+                    cache.put(keys[i], text)
+        return results
+
+    def _generate_rows(self, instructions: list, max_new_tokens: list, stops: list = None) -> tuple:
+        """One batched generate call off the prefix; returns (texts, complete) like _generate_batch."""
+        self._encode_prefix()
+        if self.past_key_values is None:
+            # Nothing to reuse: fall back to plain batched generation on the instructions.
+            inputs = self.tokenizer(instructions, return_tensors="pt", padding=True).to(self.model.device)
+            prefix_ids = inputs.input_ids[:, :0]
+            past_key_values = None
+        else:
+            inputs = self.tokenizer(instructions, return_tensors="pt", padding=True).to(self.model.device)
+            prefix_ids = self.prefix_ids.expand(len(instructions), -1)
+            past_key_values = self._expanded_cache(len(instructions))
+
+        input_ids = torch.cat([prefix_ids, inputs.input_ids], dim=1)
+        attention_mask = torch.cat([torch.ones_like(prefix_ids), inputs.attention_mask], dim=1)
+        prompt_length = input_ids.shape[1]
+        if prompt_length >= self.window:
+            raise ValueError(
+                f"Story and instructions take {prompt_length} tokens, leaving no room in the "
+                f"{self.window}-token window; use a larger reserve_tokens."
+            )
+        # Answers are capped to the room left in the window (the padding of the longest
+        # instruction counts against every row).
+        room = self.window - prompt_length
+        complete = [budget <= room for budget in max_new_tokens]
+        max_new_tokens = [min(budget, room) for budget in max_new_tokens]
+        criteria = StopCriteria(self.tokenizer, stops, prompt_length, stage="story_context") \
+            if stops and any(stops) else None
+
+        with metrics.timer("generate_seconds", model="distilgpt2", stage="story_context"):
+            outputs = self.model.generate(
+                input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                max_new_tokens=max(max_new_tokens),
+                num_return_sequences=1,
+                no_repeat_ngram_size=2,
+                pad_token_id=self.tokenizer.pad_token_id,
+                stopping_criteria=StoppingCriteriaList([criteria] if criteria else []),
+            )
+        if metrics.ENABLED:
+            # Only the suffix tokens are prefilled here; the story prefix was counted once at construction.
+            metrics.record_tokens("distilgpt2", int(inputs.attention_mask.sum()), [
+                output[prompt_length:prompt_length + budget] for output, budget in zip(outputs, max_new_tokens)
+            ], self.tokenizer.pad_token_id)
+        texts = [
+            self.tokenizer.decode(output[prompt_length:prompt_length + budget], skip_special_tokens=True)
+            for output, budget in zip(outputs, max_new_tokens)
+        ]
+        if criteria is not None:
+            for row, stop in enumerate(stops):
+                end = stop.end(texts[row]) if criteria.done[row] else None
+                if end is not None:
+                    texts[row] = texts[row][:end]
+                    complete[row] = True
+        return texts, complete
 
 
 '''
+import copy
+
 from transformers import GPT2LMHeadModel, GPT2Tokenizer
 import torch
 
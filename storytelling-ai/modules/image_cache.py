@@ -0,0 +1,125 @@
+"""
+image_cache.py
+
+Content-addressed on-disk cache for generated images.
+
+Images are stored as <key>.png, where the key is a hash of the normalised prompt
+and the image index. A JSON manifest in the same folder records each entry's
+size and last access time; once the folder exceeds its disk budget, the least
+recently used images are deleted.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_NAME = "cache_manifest.json"
+# Write last-access updates from cache hits at most this often (seconds).
+MANIFEST_SAVE_INTERVAL = 30
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case- and whitespace-insensitive form of a prompt."""
+    return " ".join(prompt.lower().split())
+
+
+def cache_key(prompt: str, index: int) -> str:
+    return hashlib.sha256(f"{normalize_prompt(prompt)}\0{index}".encode("utf-8")).hexdigest()[:32]
+
+
+class ImageCache:
+    """
+    LRU cache of image files in `directory`, bounded by `max_bytes` of disk.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._last_save = 0.0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        self._entries = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("entries", {})
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+    def _save_manifest(self) -> None:
+        # Write to a temp file and rename, so a crash never leaves a half-written manifest.
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self._entries}, f)
+        os.replace(tmp_path, self.manifest_path)
+        self._dirty = False
+        self._last_save = time.time()
+
+    def filename_for(self, key: str) -> str:
+        return f"{key}.png"
+
+    def get(self, key: str) -> str:
+        """Returns the cached filename for `key`, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(os.path.join(self.directory, entry["filename"])):
+                # The file was removed behind our back; forget the entry.
+                del self._entries[key]
+                self._dirty = True
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            entry["last_access"] = time.time()
+            self._dirty = True
+            if time.time() - self._last_save > MANIFEST_SAVE_INTERVAL:
+                self._save_manifest()
+            return entry["filename"]
+
+    def put(self, key: str, filename: str, extra_files=()) -> None:
+        """
+        Records a file already written to the cache folder (plus any derived files
+        evicted along with it), then enforces the disk budget.
+        """
+        extra_files = [name for name in extra_files if os.path.exists(os.path.join(self.directory, name))]
+        size = sum(os.path.getsize(os.path.join(self.directory, name)) for name in [filename, *extra_files])
+        with self._lock:
+            self._entries[key] = {
+                "filename": filename,
+                "extra_files": extra_files,
+                "size": size,
+                "last_access": time.time(),
+            }
+            self._evict()
+            self._save_manifest()
+
+    def _evict(self) -> None:
+        total = sum(entry["size"] for entry in self._entries.values())
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            for name in [entry["filename"], *entry.get("extra_files", [])]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            total -= entry["size"]
+            del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
@@ -1,8 +1,79 @@
 import requests
 import os
+import tempfile
 from pathlib import Path
+import threading
 import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import cv2
+import numpy as np
+
+try:
+    from modules import metrics
+    from modules.image_cache import ImageCache, cache_key
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+    from image_cache import ImageCache, cache_key
+
+# Base URL of the image service; override with IMAGE_API_URL (e.g. a local stand-in server).
+IMAGE_API_URL = os.environ.get("IMAGE_API_URL", "https://image.pollinations.ai/prompt")
+# How many images are fetched at the same time.
+MAX_PARALLEL_DOWNLOADS = int(os.environ.get("IMAGE_MAX_PARALLEL", 4))
+# (connect, read) timeouts in seconds; generation on the service side can be slow.
+REQUEST_TIMEOUT = (5, 90)
+
+# Disk budget for cached images in data/generate_images (least recently used are evicted).
+IMAGE_CACHE_MAX_MB = int(os.environ.get("IMAGE_CACHE_MAX_MB", 500))
+
+# Optional downscaled copies written next to each image, e.g. IMAGE_VARIANTS=thumb,web.
+VARIANT_WIDTHS = {"thumb": 256, "web": 1024}
+IMAGE_VARIANTS = [name for name in os.environ.get("IMAGE_VARIANTS", "").split(",") if name in VARIANT_WIDTHS]
+
+_session = None
+_session_lock = threading.Lock()
+_image_cache = None
+# Cache keys being downloaded right now, each with the future its waiters share.
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """
+    Returns the shared HTTP session: keep-alive connections pooled for parallel
+    downloads, with retries and exponential backoff on connection errors and 429/5xx.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=("GET",),
+            )
+            adapter = HTTPAdapter(pool_maxsize=MAX_PARALLEL_DOWNLOADS, max_retries=retry)
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session = session
+    return _session
+
+def get_image_cache(save_dir: str = "data/generate_images") -> ImageCache:
+    """Returns the shared cache over the image folder (created on first use)."""
+    global _image_cache
+    with _session_lock:
+        if _image_cache is None:
+            _image_cache = ImageCache(os.path.join(os.getcwd(), save_dir), IMAGE_CACHE_MAX_MB * 2**20)
+            metrics.register_cache("images", _image_cache.stats)
+    return _image_cache
+
+def unique_filename(extension: str = "png") -> str:
+    """A timestamped filename with a random suffix, so parallel downloads never collide."""
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    return f"image_{timestamp}_{uuid.uuid4().hex[:8]}.{extension}"
 
 def crop_bottom_15_percent(image_path: str) -> None:
     """
@@ -18,11 +89,58 @@ def crop_bottom_15_percent(image_path: str) -> None:
     cv2.imwrite(image_path, cropped_image)
     print(f"Bottom 15% removed. Image saved to {image_path}")
 
-def download_image(prompt: str, save_dir: str) -> str:
+def variant_filename(filename: str, variant: str) -> str:
+    """Filename of a derived size, e.g. image.png -> image_thumb.jpg."""
+    return f"{Path(filename).stem}_{variant}.jpg"
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Writes to a temp file in the same folder and renames it, so readers never see a partial file."""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def process_image(content: bytes, save_path: Path, variants=()) -> list:
+    """
+    Crops the bottom 15% of the downloaded image in memory, writes it to save_path
+    with a single PNG encode, and writes each requested variant as a downscaled JPEG.
+    Every file is replaced atomically.
+    Returns the filenames written, or an empty list (nothing written) if the content
+    isn't a decodable image, e.g. an HTML error page or a truncated body.
+    """
+    image = cv2.imdecode(np.frombuffer(content, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        print(f"Error decoding image for {save_path}")
+        return []
+
+    height, width = image.shape[:2]
+    cropped_image = image[:int(height * 0.85), :]
+    _write_atomic(save_path, cv2.imencode(".png", cropped_image)[1].tobytes())
+    written = [save_path.name]
+
+    for variant in variants:
+        target_width = VARIANT_WIDTHS[variant]
+        resized = cropped_image
+        # Only ever downscale; smaller images keep their size.
+        if width > target_width:
+            target_height = int(cropped_image.shape[0] * target_width / width)
+            resized = cv2.resize(cropped_image, (target_width, target_height), interpolation=cv2.INTER_AREA)
+        name = variant_filename(save_path.name, variant)
+        _write_atomic(save_path.parent / name, cv2.imencode(".jpg", resized, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes())
+        written.append(name)
+    print(f"Bottom 15% removed. Image saved to {save_path}")
+    return written
+
+def download_image(prompt: str, save_dir: str, filename: str = None) -> str:
     """
     Downloads an image from pollinations.ai based on the prompt,
-    crops the bottom 15% of the image, and returns a relative URL.
-    The image is saved in PNG format.
+    crops the bottom 15% of the image, and returns a relative URL
+    (None if the download failed or did not decode as an image).
+    The image is saved in PNG format, as `filename` if given.
 
     Note: Pollinations.ai only supports one model.
     """
@@ -30,9 +148,8 @@ def download_image(prompt: str, save_dir: str) -> str:
     save_dir = Path(os.path.join(base_dir, save_dir))
     save_dir.mkdir(parents=True, exist_ok=True)
     
-    # Create a unique filename using a timestamp.
-    timestamp = time.strftime("%Y%m%d_%H%M%S")
-    filename = f"image_{timestamp}.png"
+    # Create a unique filename (timestamp plus a random suffix) unless one was given.
+    filename = filename or unique_filename()
     save_path = save_dir / filename
 
     print(f"Saving image to: {save_path}")
@@ -41,36 +158,87 @@ def download_image(prompt: str, save_dir: str) -> str:
     url_prompt = prompt.replace(" ", "_")
     
     # Construct the URL. Since there is only one model, no additional parameter is required.
-    url = f"https://image.pollinations.ai/prompt/{url_prompt}"
+    url = f"{IMAGE_API_URL}/{url_prompt}"
     
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        with open(save_path, "wb") as file:
-            file.write(response.content)
+        with metrics.timer("image_download_seconds"):
+            response = get_session().get(url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+        # Crop and encode in memory so the image is written to disk only once.
+        with metrics.timer("image_process_seconds"):
+            written = process_image(response.content, save_path, IMAGE_VARIANTS)
+        if not written:
+            metrics.inc("images_downloaded_total", status="undecodable")
+            return None
+        metrics.inc("images_downloaded_total", status="ok")
         print(f"Success! Image saved as: {filename}")
         
-        crop_bottom_15_percent(str(save_path))
-        
         # Return a relative URL for Flask to serve.
         return f"/donate/images/{filename}"
     except requests.exceptions.RequestException as e:
+        metrics.inc("images_downloaded_total", status="error")
         print(f"Error downloading image: {e}")
         return None
 
-def generate_images(prompt: str, num_images: int = 1) -> list:
+def _once(key: str, fn):
+    """
+    Runs fn() for `key`, unless another thread is already running it for the same
+    key, in which case that call's result (or exception) is shared.
+    """
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        owner = future is None
+        if owner:
+            future = _in_flight[key] = Future()
+    if not owner:
+        return future.result()
+    try:
+        future.set_result(fn())
+    except BaseException as e:
+        future.set_exception(e)
+    finally:
+        with _in_flight_lock:
+            del _in_flight[key]
+    return future.result()
+
+def generate_images(prompt: str, num_images: int = 1, use_cache: bool = True) -> list:
     """
     Generates a list of image URLs (relative) by downloading the specified number
-    of images based on the given prompt.
+    of images based on the given prompt. Downloads run concurrently, up to
+    MAX_PARALLEL_DOWNLOADS at a time.
+
+    With use_cache, image i of a prompt is stored under a hash of the normalised
+    prompt and i, and later requests for it are served from disk. Concurrent
+    requests for the same uncached image share one download.
     
     Returns:
-        list: A list of relative URLs (e.g., ["/donate/images/image_TIMESTAMP.png", ...]).
+        list: A list of relative URLs (e.g., ["/donate/images/<hash>.png", ...]).
     """
     save_dir = "data/generate_images"
-    image_urls = []
-    for i in range(num_images):
+    if num_images < 1:
+        return []
+    cache = get_image_cache(save_dir) if use_cache else None
+
+    def fetch(i):
+        if cache is None:
+            print(f"Generating image {i+1} of {num_images}...")
+            return download_image(prompt, save_dir)
+        key = cache_key(prompt, i)
+        return _once(key, lambda: fetch_cached(i, key))
+
+    def fetch_cached(i, key):
+        cached = cache.get(key)
+        if cached:
+            return f"/donate/images/{cached}"
         print(f"Generating image {i+1} of {num_images}...")
-        url = download_image(prompt, save_dir)
+        filename = cache.filename_for(key)
+        url = download_image(prompt, save_dir, filename)
         if url:
-            image_urls.append(url)
-    return image_urls
+            variants = [variant_filename(filename, variant) for variant in IMAGE_VARIANTS]
+            cache.put(key, filename, variants)
+        return url
+
+    # Download in parallel (bounded); map() keeps the results in request order.
+    with ThreadPoolExecutor(max_workers=min(num_images, MAX_PARALLEL_DOWNLOADS)) as executor:
+        results = list(executor.map(fetch, range(num_images)))
+    return [url for url in results if url]
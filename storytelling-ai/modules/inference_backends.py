@@ -0,0 +1,80 @@
+"""
+inference_backends.py
+
+Loads the causal language models (distilgpt2, DialoGPT) with the inference
+backend chosen by the INFERENCE_BACKEND environment variable:
+
+- "fp32" (default): the regular PyTorch model.
+- "int8": PyTorch dynamic int8 quantization of the linear layers (CPU only).
+  GPT-2 style models implement their projections with transformers' Conv1D,
+  which torch's dynamic quantization doesn't know about, so those layers are
+  first converted to equivalent nn.Linear layers.
+- "onnx": an ONNX Runtime graph exported through optimum (optional dependency:
+  pip install optimum[onnxruntime]).
+
+Callers get an object with the usual generate()/forward() API in every case.
+"""
+
+import os
+
+# torch/transformers are imported inside the functions so that importing this
+# module (e.g. through the model registry) stays cheap.
+
+BACKENDS = ("fp32", "int8", "onnx")
+
+
+def selected_backend() -> str:
+    backend = os.environ.get("INFERENCE_BACKEND", "fp32").lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown INFERENCE_BACKEND '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+    return backend
+
+
+def conv1d_to_linear(model):
+    """Replaces every transformers Conv1D (weight stored as in x out) with an nn.Linear, in place."""
+    from torch import nn
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for child_name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                in_features, out_features = child.weight.shape
+                linear = nn.Linear(in_features, out_features)
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, child_name, linear)
+    return model
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of all linear layers (weights int8, activations quantized on the fly)."""
+    import torch
+    from torch import nn
+
+    model = conv1d_to_linear(model.to("cpu").eval())
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+def load_causal_lm(model_name: str, backend: str = None, device=None):
+    """
+    Loads `model_name` (hub id or local path) as a causal LM using `backend`
+    (default: INFERENCE_BACKEND). int8 and onnx models always run on the CPU.
+    """
+    backend = backend or selected_backend()
+    if backend == "onnx":
+        try:
+            from optimum.onnxruntime import ORTModelForCausalLM
+        except ImportError as e:
+            raise ImportError(
+                "INFERENCE_BACKEND=onnx needs optimum: pip install optimum[onnxruntime]"
+            ) from e
+        return ORTModelForCausalLM.from_pretrained(model_name, export=True, use_cache=True)
+
+    from transformers import AutoModelForCausalLM
+    model = AutoModelForCausalLM.from_pretrained(model_name)
+    model.eval()
+    if backend == "int8":
+        return quantize_int8(model)
+    if device is not None:
+        model.to(device)
+    return model
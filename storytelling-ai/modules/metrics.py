@@ -0,0 +1,208 @@
+"""
+metrics.py
+
+Lightweight in-process metrics rendered in the Prometheus text format.
+
+- inc(name, value, **labels): add to a counter.
+- timer(name, **labels): context manager recording a duration into a histogram.
+- register_gauge(name, fn): a value computed at scrape time (queue depths, cache stats).
+- render(): the text served by each app's /metrics endpoint.
+- install(app): adds per-endpoint request timing and the /metrics route to a Flask app.
+
+Set METRICS_ENABLED=0 to turn recording into a no-op.
+"""
+
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+ENABLED = os.environ.get("METRICS_ENABLED", "1") != "0"
+PREFIX = "storytelling_"
+# Histogram bucket upper bounds in seconds; the hot paths range from milliseconds to minutes.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_counters = {}
+_histograms = {}
+_gauges = {}
+_help = {}
+_caches = {}
+_buckets = {}
+_NULL_TIMER = nullcontext()
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def describe(name: str, text: str) -> None:
+    """Sets the HELP text for a metric."""
+    _help[name] = text
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_buckets(name: str, buckets: tuple) -> None:
+    """Uses `buckets` instead of BUCKETS for the histogram `name` (e.g. one that counts items, not seconds)."""
+    _buckets[name] = tuple(buckets)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    buckets = _buckets.get(name, BUCKETS)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            # Per-bucket counts (non-cumulative) followed by +Inf, then the sum.
+            histogram = _histograms[key] = [[0] * (len(buckets) + 1), 0.0]
+        histogram[0][bisect.bisect_left(buckets, value)] += 1
+        histogram[1] += value
+
+
+@contextmanager
+def _timer(name: str, labels: dict):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timer(name: str, **labels):
+    """Times the enclosed block into the histogram `name` (seconds)."""
+    if not ENABLED:
+        return _NULL_TIMER
+    return _timer(name, labels)
+
+
+def record_tokens(model_name: str, prompt_tokens: int, new_token_rows, pad_token_id) -> None:
+    """
+    Counts prompt and generated tokens for one generate call. new_token_rows are
+    the generated id tensors per row; padding after an early stop is excluded.
+    """
+    generated = sum(int((row != pad_token_id).sum()) for row in new_token_rows)
+    inc("prompt_tokens_total", prompt_tokens, model=model_name)
+    inc("generated_tokens_total", generated, model=model_name)
+
+
+def register_gauge(name: str, fn, help_text: str = "") -> None:
+    """
+    Registers a gauge computed at scrape time. fn returns a number, or a dict
+    mapping label dicts (as tuples of (key, value) pairs) to numbers.
+    """
+    _gauges[name] = fn
+    if help_text:
+        describe(name, help_text)
+
+
+def register_cache(cache_name: str, stats_fn) -> None:
+    """
+    Exposes a cache whose stats_fn() returns at least "hits", "misses" and
+    "entries" as cache_hits / cache_misses / cache_entries / cache_hit_rate
+    gauges, labelled cache=<cache_name>.
+    """
+    _caches[cache_name] = stats_fn
+    for field in ("hits", "misses", "entries", "hit_rate"):
+        if f"cache_{field}" not in _gauges:
+            register_gauge(f"cache_{field}", lambda field=field: _cache_field(field), f"Cache {field} per cache")
+
+
+def _cache_field(field: str) -> dict:
+    values = {}
+    for cache_name, stats_fn in list(_caches.items()):
+        stats = stats_fn()
+        if field == "hit_rate":
+            total = stats.get("hits", 0) + stats.get("misses", 0)
+            value = round(stats.get("hits", 0) / total, 4) if total else 0.0
+        else:
+            value = stats.get(field, 0)
+        values[(("cache", cache_name),)] = value
+    return values
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{key}="{str(value)}"'.replace("\n", " ") for key, value in pairs)
+    return "{" + body + "}"
+
+
+def render() -> str:
+    """Returns all metrics in the Prometheus text exposition format."""
+    lines = []
+
+    def header(name, kind):
+        full = PREFIX + name
+        if name in _help:
+            lines.append(f"# HELP {full} {_help[name]}")
+        lines.append(f"# TYPE {full} {kind}")
+        return full
+
+    with _lock:
+        counters = dict(_counters)
+        histograms = {key: (list(value[0]), value[1]) for key, value in _histograms.items()}
+
+    for name in sorted({name for name, _ in counters}):
+        full = header(name, "counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{full}{_format_labels(labels)} {value}")
+
+    for name in sorted({name for name, _ in histograms}):
+        full = header(name, "histogram")
+        for (metric, labels), (buckets, total) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(list(_buckets.get(name, BUCKETS)) + ["+Inf"], buckets):
+                cumulative += count
+                lines.append(f"{full}_bucket{_format_labels(labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{full}_sum{_format_labels(labels)} {total}")
+            lines.append(f"{full}_count{_format_labels(labels)} {cumulative}")
+
+    for name, fn in sorted(_gauges.items()):
+        try:
+            value = fn()
+        except Exception:
+            continue
+        full = header(name, "gauge")
+        if isinstance(value, dict):
+            for labels, item in sorted(value.items()):
+                lines.append(f"{full}{_format_labels(labels)} {item}")
+        else:
+            lines.append(f"{full} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def install(app) -> None:
+    """Times every request of the Flask `app` per endpoint and status, and serves GET /metrics."""
+    from flask import Response, g, request
+
+    if ENABLED:
+        @app.before_request
+        def _start_timer():
+            g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        def _record_request(response):
+            start = g.pop("metrics_start", None)
+            if start is not None and request.endpoint != "metrics":
+                observe("http_request_seconds", time.perf_counter() - start,
+                        endpoint=request.endpoint or "unknown", status=response.status_code)
+            return response
+
+    @app.route("/metrics", methods=["GET"], endpoint="metrics")
+    def metrics_endpoint():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,204 @@
+"""
+model_registry.py
+
+Central registry for every model the app uses. Nothing is loaded at import time:
+each model is loaded on first use, kept as a single instance per process, and its
+load time and resident-memory cost are recorded.
+
+Call warmup() at deploy time to preload models before serving requests.
+"""
+
+import os
+import threading
+import time
+
+try:
+    from modules import metrics
+    from modules.inference_backends import load_causal_lm, selected_backend
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+    from inference_backends import load_causal_lm, selected_backend
+
+_LOADERS = {}
+_INSTANCES = {}
+_STATS = {}
+_LOCKS = {}
+_REGISTRY_LOCK = threading.Lock()
+
+
+def current_rss_bytes() -> int:
+    """Returns the resident set size of this process in bytes (0 if unavailable)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        return 0
+
+
+def device():
+    """The torch device models are moved to (GPU if available)."""
+    import torch
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def register(name: str, loader) -> None:
+    """Registers a zero-argument loader function under `name`."""
+    with _REGISTRY_LOCK:
+        _LOADERS[name] = loader
+        _LOCKS.setdefault(name, threading.Lock())
+
+
+def get(name: str):
+    """Returns the model registered as `name`, loading it on first use."""
+    instance = _INSTANCES.get(name)
+    if instance is not None:
+        return instance
+    if name not in _LOADERS:
+        raise KeyError(f"Unknown model '{name}'. Registered: {sorted(_LOADERS)}")
+    with _LOCKS[name]:
+        # Another thread may have finished loading while we waited.
+        if name not in _INSTANCES:
+            rss_before = current_rss_bytes()
+            start = time.perf_counter()
+            _INSTANCES[name] = _LOADERS[name]()
+            _STATS[name] = {
+                "load_seconds": round(time.perf_counter() - start, 3),
+                "rss_delta_mb": round((current_rss_bytes() - rss_before) / 2**20, 1),
+            }
+            print(f"Loaded model '{name}' in {_STATS[name]['load_seconds']}s "
+                  f"(+{_STATS[name]['rss_delta_mb']} MB RSS)")
+    return _INSTANCES[name]
+
+
+def is_loaded(name: str) -> bool:
+    return name in _INSTANCES
+
+
+def warmup(names=None) -> dict:
+    """
+    Preloads the given models (all registered models by default) and returns stats().
+    """
+    for name in names or list(_LOADERS):
+        get(name)
+    return stats()
+
+
+def stats() -> dict:
+    """
+    Returns per-model load statistics plus the current process RSS:
+    {"models": {name: {"loaded": bool, "load_seconds": float, "rss_delta_mb": float}},
+     "inference_backend": str, "rss_mb": float}
+    """
+    models = {}
+    for name in _LOADERS:
+        models[name] = {"loaded": name in _INSTANCES, **_STATS.get(name, {})}
+    return {
+        "models": models,
+        "inference_backend": selected_backend(),
+        "rss_mb": round(current_rss_bytes() / 2**20, 1),
+    }
+
+
+metrics.register_gauge(
+    "model_load_seconds",
+    lambda: {(("model", name),): stat["load_seconds"] for name, stat in list(_STATS.items())},
+    "Time each loaded model took to load",
+)
+metrics.register_gauge("resident_memory_bytes", current_rss_bytes, "Resident set size of the process")
+
+
+# ---------------------------------------------------------------------
+# MODEL LOADERS
+# ---------------------------------------------------------------------
+
+# The generation models below load with the backend selected by INFERENCE_BACKEND
+# (fp32, int8 or onnx); see inference_backends.py.
+
+def _load_distilgpt2():
+    from transformers import GPT2Tokenizer
+    # Use distilgpt2 for faster inference.
+    tokenizer = GPT2Tokenizer.from_pretrained("distilgpt2")
+    # Set pad_token to eos_token if not already set.
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    # Decoder-only models continue from the last prompt token, so batches are left-padded.
+    tokenizer.padding_side = "left"
+    model = load_causal_lm("distilgpt2", device=device())
+    return tokenizer, model
+
+
+# With ASSISTED_DECODING=1, idea_generator decodes with a larger GPT-2 family model
+# ("gpt2_target", registered only then) and distilgpt2 drafts tokens for it. Any
+# checkpoint sharing GPT-2's vocabulary works.
+ASSISTED_DECODING = os.environ.get("ASSISTED_DECODING", "0") == "1"
+ASSISTED_TARGET_MODEL = os.environ.get("ASSISTED_TARGET_MODEL", "gpt2-medium")
+
+
+def _load_gpt2_target():
+    from transformers import GPT2Tokenizer
+    tokenizer = GPT2Tokenizer.from_pretrained(ASSISTED_TARGET_MODEL)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = load_causal_lm(ASSISTED_TARGET_MODEL, device=device())
+    return tokenizer, model
+
+
+def _load_dialogpt():
+    from transformers import AutoTokenizer
+    # Using DialoGPT-medium for quality (use DialoGPT-small if you prefer speed).
+    tokenizer = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
+    model = load_causal_lm("microsoft/DialoGPT-medium", device=device())
+    return tokenizer, model
+
+
+def _load_spacy():
+    import spacy
+    # Load spaCy English model (ensure you've run: python -m spacy download en_core_web_sm).
+    # Only NER is used, so the components it doesn't need are never loaded (in the small
+    # model the NER has its own embedding layer; the shared tok2vec only feeds tagger/parser).
+    return spacy.load(
+        "en_core_web_sm",
+        exclude=["tok2vec", "tagger", "parser", "attribute_ruler", "lemmatizer", "senter"],
+    )
+
+
+def _load_languagetool():
+    import language_tool_python
+    # Initialize LanguageTool for US English (starts a local Java server).
+    return language_tool_python.LanguageTool('en-US')
+
+
+def _load_sentiment():
+    from transformers import pipeline
+    return pipeline(
+        "sentiment-analysis",
+        model="distilbert-base-uncased-finetuned-sst-2-english"
+    )
+
+
+register("distilgpt2", _load_distilgpt2)
+register("dialogpt", _load_dialogpt)
+register("spacy", _load_spacy)
+register("languagetool", _load_languagetool)
+register("sentiment", _load_sentiment)
+
+if ASSISTED_DECODING:
+    # transformers' assisted generation needs a PyTorch model to verify the draft tokens.
+    if selected_backend() == "onnx":
+        raise ValueError("ASSISTED_DECODING=1 needs INFERENCE_BACKEND=fp32 or int8, not onnx.")
+    register("gpt2_target", _load_gpt2_target)
+
+
+if __name__ == "__main__":
+    import json
+    import sys
+
+    # Usage: python modules/model_registry.py [model names...]
+    print(json.dumps(warmup(sys.argv[1:] or None), indent=4))
@@ -0,0 +1,157 @@
+"""
+stopping.py
+
+Task-specific stop conditions for generate_idea / generate_ideas and StoryContext.
+
+Most extractors keep only a small part of what they generate (the first line
+after "Title:", three bullet points, one JSON object) and parse away the rest,
+so decoding past that part is wasted work. A stop condition ends its row of the
+batch as soon as the part its caller keeps is complete, and the text after that
+part is trimmed, so callers parse exactly what they would have parsed from the
+full-length output. A row that never completes runs to its budget untrimmed.
+
+- FirstLine(max_words=None): the first non-empty line, or its first max_words words.
+- Lines(n, marker="-"): n complete non-empty lines from the first `marker` (bullet lists).
+- JsonObject(): the first balanced {...} object.
+
+Cancelled(event) ends a whole generation once a threading.Event is set (e.g. when
+the client of a streamed generation has gone away).
+
+Conditions only look at the generated text, never the prompt. Each has a `key`
+that becomes part of the generation cache key.
+"""
+
+import re
+
+import torch
+from transformers import StoppingCriteria
+
+try:
+    from modules import metrics
+except ModuleNotFoundError:
+    # Fallback if your project structure differs
+    import metrics
+
+_WORD = re.compile(r"\S+")
+
+
+class FirstLine:
+    """Stops once the first non-empty line (or its first `max_words` words) is complete."""
+
+    def __init__(self, max_words: int = None):
+        self.max_words = max_words
+        self.key = f"first_line:{max_words}" if max_words else "first_line"
+        # Only a token containing one of these can complete the condition.
+        self.triggers = "\n" if max_words is None else " \t\n"
+
+    def end(self, text: str):
+        """Index just past the part of `text` to keep, or None while it is incomplete."""
+        start = len(text) - len(text.lstrip())
+        newline = text.find("\n", start)
+        line_end = newline if newline != -1 else None
+        if self.max_words:
+            words = list(_WORD.finditer(text, start, line_end if line_end is not None else len(text)))
+            # The last word is only complete once something follows it.
+            if len(words) > self.max_words or (len(words) == self.max_words and words[-1].end() < len(text)):
+                return words[self.max_words - 1].end()
+        return line_end
+
+
+class Lines:
+    """Stops once `n` complete non-empty lines follow the first `marker` (e.g. n bullet points)."""
+
+    def __init__(self, n: int, marker: str = "-"):
+        self.n = n
+        self.marker = marker
+        self.key = f"lines:{n}:{marker}"
+        self.triggers = "\n"
+
+    def end(self, text: str):
+        start = text.find(self.marker)
+        if start == -1:
+            return None
+        count = 0
+        line_start = start
+        while True:
+            newline = text.find("\n", line_start)
+            if newline == -1:
+                return None
+            if text[line_start:newline].strip():
+                count += 1
+                if count == self.n:
+                    return newline
+            line_start = newline + 1
+
+
+class JsonObject:
+    """Stops once the first {...} object is closed (braces inside strings are ignored)."""
+
+    key = "json_object"
+    triggers = "}"
+
+    def end(self, text: str):
+        start = text.find("{")
+        if start == -1:
+            return None
+        depth, in_string, escaped = 0, False, False
+        for i in range(start, len(text)):
+            char = text[i]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    return i + 1
+        return None
+
+
+def cache_params(stop) -> dict:
+    """Extra generation-cache key parameters for a stop condition (none without one)."""
+    return {"stop": stop.key} if stop is not None else {}
+
+
+class Cancelled(StoppingCriteria):
+    """Ends every row as soon as `event` is set."""
+
+    def __init__(self, event):
+        self.event = event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class StopCriteria(StoppingCriteria):
+    """
+    Ends each row of a left-padded batch once its own condition is met. `stops`
+    holds one condition (or None) per row; generated text starts at `prompt_length`.
+    """
+
+    def __init__(self, tokenizer, stops: list, prompt_length: int, stage: str = "generate_idea"):
+        self.tokenizer = tokenizer
+        self.stops = stops
+        self.prompt_length = prompt_length
+        self.stage = stage
+        self.done = [False] * len(stops)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        for row, stop in enumerate(self.stops):
+            if stop is None or self.done[row] or input_ids.shape[1] <= self.prompt_length:
+                continue
+            # Skip the full decode unless the newest token can complete the condition.
+            last = self.tokenizer.decode(input_ids[row, -1:], skip_special_tokens=True)
+            if not any(char in last for char in stop.triggers):
+                continue
+            text = self.tokenizer.decode(input_ids[row, self.prompt_length:], skip_special_tokens=True)
+            if stop.end(text) is not None:
+                self.done[row] = True
+                metrics.inc("generation_early_stops_total", stage=self.stage, condition=stop.key)
+        return torch.tensor(self.done, dtype=torch.bool, device=input_ids.device)
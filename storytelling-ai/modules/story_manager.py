@@ -1,96 +1,507 @@
 # story_manager.py
+"""
+story_manager.py
+
+Stores stories (metadata, content and characters) behind a pluggable backend.
+
+- SqliteStoryStore (default): data/stories.db in WAL mode. Content is kept as
+  appended chunks, so appends and character updates touch one row instead of
+  rewriting every story, and concurrent writers no longer lose updates.
+- JsonStoryStore: the original single stories.json file.
+
+Pick the backend with the STORY_BACKEND environment variable ("sqlite" or "json").
+The module-level functions keep their original signatures and work with either.
+"""
 import json
 import os
+import sqlite3
+import threading
 
-STORY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "stories.json")
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data")
+STORY_FILE = os.path.join(DATA_DIR, "stories.json")
+STORY_DB = os.path.join(DATA_DIR, "stories.db")
 
-def load_all_stories() -> dict:
+
+def _blank_story(content: str = "") -> dict:
+    return {
+        "title": "",
+        "premise": "",
+        "genre": "",
+        "content": content,
+        "characters": {}
+    }
+
+
+def _blank_character() -> dict:
+    return {
+        "personality": "",
+        "backstory": "",
+        "first_appearance": "",
+        "last_appearance": ""
+    }
+
+
+class JsonStoryStore:
     """
-    Load all stories from 'stories.json'. Return an empty dict if the file doesn't exist or is invalid.
+    Keeps every story in one JSON file. Each update re-reads and rewrites the whole
+    file; a lock serialises writers within the process.
     """
-    if not os.path.exists(STORY_FILE):
-        return {}
-    with open(STORY_FILE, "r", encoding="utf-8") as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
+
+    def __init__(self, path: str = STORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load_all(self) -> dict:
+        if not os.path.exists(self.path):
             return {}
+        with open(self.path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError:
+                return {}
 
-def save_all_stories(data: dict) -> None:
+    def save_all(self, data: dict) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4)
+
+    def get_story(self, story_id: str) -> dict:
+        return self.load_all().get(story_id)
+
+    def update_metadata(self, story_id: str, title: str, premise: str, genre: str) -> None:
+        with self._lock:
+            data = self.load_all()
+            # If this story doesn't exist yet, create a blank structure
+            if story_id not in data:
+                data[story_id] = _blank_story()
+                data[story_id].update(title=title, premise=premise, genre=genre)
+            else:
+                # Update fields if they're provided
+                if title:
+                    data[story_id]["title"] = title
+                if premise:
+                    data[story_id]["premise"] = premise
+                if genre:
+                    data[story_id]["genre"] = genre
+            self.save_all(data)
+
+    def append_content(self, story_id: str, text: str) -> None:
+        with self._lock:
+            data = self.load_all()
+            if story_id not in data:
+                data[story_id] = _blank_story(text)
+            else:
+                data[story_id]["content"] += "\n" + text  # Append the new text
+            self.save_all(data)
+
+    def content_length(self, story_id: str) -> int:
+        story = self.get_story(story_id)
+        return len(story["content"]) if story else 0
+
+    def content_slice(self, story_id: str, start: int, end: int = None) -> str:
+        story = self.get_story(story_id)
+        return story["content"][start:end] if story else ""
+
+    def get_summary(self, story_id: str) -> tuple:
+        summary = (self.get_story(story_id) or {}).get("summary") or {}
+        return summary.get("covered_chars", 0), summary.get("text", "")
+
+    def set_summary(self, story_id: str, covered_chars: int, text: str) -> None:
+        with self._lock:
+            data = self.load_all()
+            if story_id not in data:
+                return
+            current = data[story_id].get("summary") or {}
+            if covered_chars >= current.get("covered_chars", 0):
+                data[story_id]["summary"] = {"covered_chars": covered_chars, "text": text}
+                self.save_all(data)
+
+    def get_characters(self, story_id: str) -> dict:
+        return (self.get_story(story_id) or {}).get("characters", {})
+
+    def update_character(self, story_id: str, name: str, **fields) -> None:
+        with self._lock:
+            data = self.load_all()
+            # If this story doesn't exist, create a default structure
+            if story_id not in data:
+                data[story_id] = _blank_story()
+            # If character doesn't exist yet, create a blank object
+            if name not in data[story_id]["characters"]:
+                data[story_id]["characters"][name] = _blank_character()
+            data[story_id]["characters"][name].update(fields)
+            self.save_all(data)
+
+
+class SqliteStoryStore:
     """
-    Save the entire 'data' dict to 'stories.json'.
+    Keeps stories in SQLite (WAL mode). Story content is stored as ordered chunks,
+    one row per append, and joined with newlines when read back.
     """
-    with open(STORY_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
 
-def update_story_metadata(story_id: str, title: str = "", premise: str = "", genre: str = "") -> None:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS stories (
+            id TEXT PRIMARY KEY,
+            title TEXT NOT NULL DEFAULT '',
+            premise TEXT NOT NULL DEFAULT '',
+            genre TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS story_chunks (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            story_id TEXT NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_story_chunks_story ON story_chunks (story_id, seq);
+        CREATE TABLE IF NOT EXISTS characters (
+            story_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            personality TEXT NOT NULL DEFAULT '',
+            backstory TEXT NOT NULL DEFAULT '',
+            first_appearance TEXT NOT NULL DEFAULT '',
+            last_appearance TEXT NOT NULL DEFAULT '',
+            PRIMARY KEY (story_id, name)
+        );
+        CREATE TABLE IF NOT EXISTS story_summaries (
+            story_id TEXT PRIMARY KEY,
+            covered_chars INTEGER NOT NULL,
+            text TEXT NOT NULL
+        );
     """
-    Create or update metadata for a story, keyed by story_id.
-    """
-    data = load_all_stories()
-    # If this story doesn't exist yet, create a blank structure
-    if story_id not in data:
-        data[story_id] = {
+    CHARACTER_FIELDS = ("personality", "backstory", "first_appearance", "last_appearance")
+
+    def __init__(self, path: str = STORY_DB):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript(self.SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared across threads, so keep one per thread.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None: transactions are opened explicitly with BEGIN IMMEDIATE.
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _write(self, fn):
+        """Runs fn(conn) inside one write transaction."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fn(conn)
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    @staticmethod
+    def _create_story(conn, story_id: str, content: str = "") -> bool:
+        """Creates the story if missing; returns True if it was created."""
+        created = conn.execute(
+            "INSERT OR IGNORE INTO stories (id) VALUES (?)", (story_id,)
+        ).rowcount == 1
+        if created:
+            conn.execute("INSERT INTO story_chunks (story_id, text) VALUES (?, ?)", (story_id, content))
+        return created
+
+    def _read_story(self, conn, story_id: str, title: str, premise: str, genre: str) -> dict:
+        chunks = conn.execute(
+            "SELECT text FROM story_chunks WHERE story_id = ? ORDER BY seq", (story_id,)
+        ).fetchall()
+        return {
             "title": title,
             "premise": premise,
             "genre": genre,
-            "content": "",
-            "characters": {}
+            "content": "\n".join(chunk[0] for chunk in chunks),
+            "characters": self._read_characters(conn, story_id)
         }
-    else:
-        # Update fields if they're provided
-        if title:
-            data[story_id]["title"] = title
-        if premise:
-            data[story_id]["premise"] = premise
-        if genre:
-            data[story_id]["genre"] = genre
-    
-    save_all_stories(data)
+
+    def _read_characters(self, conn, story_id: str) -> dict:
+        characters = {}
+        for row in conn.execute(
+            "SELECT name, personality, backstory, first_appearance, last_appearance "
+            "FROM characters WHERE story_id = ? ORDER BY rowid", (story_id,)
+        ):
+            characters[row[0]] = dict(zip(self.CHARACTER_FIELDS, row[1:]))
+        return characters
+
+    def load_all(self) -> dict:
+        conn = self._conn()
+        rows = conn.execute("SELECT id, title, premise, genre FROM stories ORDER BY rowid").fetchall()
+        return {row[0]: self._read_story(conn, *row) for row in rows}
+
+    def save_all(self, data: dict) -> None:
+        def replace_all(conn):
+            conn.execute("DELETE FROM stories")
+            conn.execute("DELETE FROM story_chunks")
+            conn.execute("DELETE FROM characters")
+            conn.execute("DELETE FROM story_summaries")
+            for story_id, story in data.items():
+                self._insert_story(conn, story_id, story)
+        self._write(replace_all)
+
+    def _insert_story(self, conn, story_id: str, story: dict) -> None:
+        conn.execute(
+            "INSERT OR REPLACE INTO stories (id, title, premise, genre) VALUES (?, ?, ?, ?)",
+            (story_id, story.get("title", ""), story.get("premise", ""), story.get("genre", "")),
+        )
+        conn.execute("DELETE FROM story_chunks WHERE story_id = ?", (story_id,))
+        # The content is replaced, so any summary of it is stale.
+        conn.execute("DELETE FROM story_summaries WHERE story_id = ?", (story_id,))
+        conn.execute(
+            "INSERT INTO story_chunks (story_id, text) VALUES (?, ?)", (story_id, story.get("content", ""))
+        )
+        for name, character in story.get("characters", {}).items():
+            conn.execute(
+                "INSERT OR REPLACE INTO characters (story_id, name, personality, backstory, "
+                "first_appearance, last_appearance) VALUES (?, ?, ?, ?, ?, ?)",
+                (story_id, name, *(str(character.get(field, "")) for field in self.CHARACTER_FIELDS)),
+            )
+
+    def get_story(self, story_id: str) -> dict:
+        conn = self._conn()
+        row = conn.execute(
+            "SELECT id, title, premise, genre FROM stories WHERE id = ?", (story_id,)
+        ).fetchone()
+        return self._read_story(conn, *row) if row else None
+
+    def update_metadata(self, story_id: str, title: str, premise: str, genre: str) -> None:
+        def update(conn):
+            self._create_story(conn, story_id)
+            # Only overwrite the fields that were provided.
+            conn.execute(
+                "UPDATE stories SET "
+                "title = CASE WHEN ? != '' THEN ? ELSE title END, "
+                "premise = CASE WHEN ? != '' THEN ? ELSE premise END, "
+                "genre = CASE WHEN ? != '' THEN ? ELSE genre END "
+                "WHERE id = ?",
+                (title, title, premise, premise, genre, genre, story_id),
+            )
+        self._write(update)
+
+    def append_content(self, story_id: str, text: str) -> None:
+        def append(conn):
+            if not self._create_story(conn, story_id, text):
+                conn.execute("INSERT INTO story_chunks (story_id, text) VALUES (?, ?)", (story_id, text))
+        self._write(append)
+
+    def _chunk_spans(self, conn, story_id: str) -> list:
+        """(seq, start, length) of every chunk, where start is its offset in the joined content."""
+        spans, position = [], 0
+        for seq, length in conn.execute(
+            "SELECT seq, LENGTH(text) FROM story_chunks WHERE story_id = ? ORDER BY seq", (story_id,)
+        ):
+            spans.append((seq, position, length))
+            position += length + 1  # the newline joining it to the next chunk
+        return spans
+
+    def content_length(self, story_id: str) -> int:
+        spans = self._chunk_spans(self._conn(), story_id)
+        return spans[-1][1] + spans[-1][2] if spans else 0
+
+    def content_slice(self, story_id: str, start: int, end: int = None) -> str:
+        # Only the chunks overlapping [start, end) are read, plus the one after a
+        # slice that ends on a joining newline (the newline only exists once joined).
+        conn = self._conn()
+        spans = [
+            span for span in self._chunk_spans(conn, story_id)
+            if span[1] + span[2] + 1 > start and (end is None or span[1] <= end)
+        ]
+        if not spans:
+            return ""
+        texts = [
+            conn.execute("SELECT text FROM story_chunks WHERE seq = ?", (seq,)).fetchone()[0]
+            for seq, _, _ in spans
+        ]
+        base = spans[0][1]
+        joined = "\n".join(texts)
+        return joined[max(0, start - base):None if end is None else end - base]
+
+    def get_summary(self, story_id: str) -> tuple:
+        row = self._conn().execute(
+            "SELECT covered_chars, text FROM story_summaries WHERE story_id = ?", (story_id,)
+        ).fetchone()
+        return (row[0], row[1]) if row else (0, "")
+
+    def set_summary(self, story_id: str, covered_chars: int, text: str) -> None:
+        def upsert(conn):
+            # Never replace a summary that already covers more of the story.
+            conn.execute(
+                "INSERT INTO story_summaries (story_id, covered_chars, text) VALUES (?, ?, ?) "
+                "ON CONFLICT(story_id) DO UPDATE SET covered_chars = excluded.covered_chars, text = excluded.text "
+                "WHERE excluded.covered_chars >= story_summaries.covered_chars",
+                (story_id, covered_chars, text),
+            )
+        self._write(upsert)
+
+    def get_characters(self, story_id: str) -> dict:
+        return self._read_characters(self._conn(), story_id)
+
+    def update_character(self, story_id: str, name: str, **fields) -> None:
+        unknown = set(fields) - set(self.CHARACTER_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown character fields: {sorted(unknown)}")
+
+        def update(conn):
+            self._create_story(conn, story_id)
+            conn.execute(
+                "INSERT OR IGNORE INTO characters (story_id, name) VALUES (?, ?)", (story_id, name)
+            )
+            for field, value in fields.items():
+                conn.execute(
+                    f"UPDATE characters SET {field} = ? WHERE story_id = ? AND name = ?",
+                    (value, story_id, name),
+                )
+        self._write(update)
+
+    def import_json(self, json_path: str = STORY_FILE) -> int:
+        """
+        One-shot import of an existing stories.json. Stories already in the database
+        with the same id are replaced. Returns the number of stories imported.
+        """
+        data = JsonStoryStore(json_path).load_all()
+
+        def import_all(conn):
+            for story_id, story in data.items():
+                conn.execute("DELETE FROM characters WHERE story_id = ?", (story_id,))
+                self._insert_story(conn, story_id, story)
+        self._write(import_all)
+        return len(data)
+
+
+_STORE = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store():
+    """
+    Returns the process-wide story store selected by STORY_BACKEND.
+    A new SQLite database is seeded from stories.json when that file exists.
+    """
+    global _STORE
+    if _STORE is None:
+        with _STORE_LOCK:
+            if _STORE is None:
+                if os.environ.get("STORY_BACKEND", "sqlite") == "json":
+                    _STORE = JsonStoryStore()
+                else:
+                    is_new = not os.path.exists(STORY_DB)
+                    store = SqliteStoryStore()
+                    if is_new and os.path.exists(STORY_FILE):
+                        count = store.import_json(STORY_FILE)
+                        print(f"Imported {count} stories from {STORY_FILE} into {STORY_DB}")
+                    _STORE = store
+    return _STORE
+
+
+def set_store(store) -> None:
+    """Replaces the process-wide story store (e.g. with a store on another path)."""
+    global _STORE
+    _STORE = store
+
+
+def load_all_stories() -> dict:
+    """
+    Load all stories. Return an empty dict if there are none.
+    """
+    return get_store().load_all()
+
+
+def save_all_stories(data: dict) -> None:
+    """
+    Replace all stored stories with the 'data' dict.
+    """
+    get_store().save_all(data)
+
+
+def get_story(story_id: str) -> dict:
+    """
+    Load a single story by id, or None if it doesn't exist.
+    """
+    return get_store().get_story(story_id)
+
+
+def update_story_metadata(story_id: str, title: str = "", premise: str = "", genre: str = "") -> None:
+    """
+    Create or update metadata for a story, keyed by story_id.
+    """
+    get_store().update_metadata(story_id, title, premise, genre)
+
 
 def append_story_content(story_id: str, text: str) -> None:
     """
     Append new text to the 'content' field of the specified story.
     If story_id doesn't exist, create it with minimal fields.
     """
-    data = load_all_stories()
-    if story_id not in data:
-        data[story_id] = {
-            "title": "",
-            "premise": "",
-            "genre": "",
-            "content": text,
-            "characters": {}
-        }
-    else:
-        data[story_id]["content"] += "\n" + text  # Append the new text
-    
-    save_all_stories(data)
+    get_store().append_content(story_id, text)
+
+
+def story_content_length(story_id: str) -> int:
+    """
+    Length in characters of the story's content (0 if the story doesn't exist).
+    """
+    return get_store().content_length(story_id)
+
+
+def story_content_slice(story_id: str, start: int, end: int = None) -> str:
+    """
+    content[start:end] of the specified story, without reading the rest of it
+    (with the SQLite backend).
+    """
+    return get_store().content_slice(story_id, start, end)
+
+
+def get_story_summary(story_id: str) -> tuple:
+    """
+    Returns (covered_chars, summary): a summary of content[:covered_chars], or (0, "").
+    """
+    return get_store().get_summary(story_id)
+
+
+def set_story_summary(story_id: str, covered_chars: int, summary: str) -> None:
+    """
+    Store a summary of content[:covered_chars]. A stored summary that already
+    covers more of the story is kept.
+    """
+    get_store().set_summary(story_id, covered_chars, summary)
+
+
+def get_story_characters(story_id: str) -> dict:
+    """
+    The story's characters ({name: fields}, empty if the story doesn't exist),
+    without reading its content.
+    """
+    return get_store().get_characters(story_id)
+
 
 def update_character_in_story(story_id: str, name: str, personality: str, backstory: str) -> None:
     """
     Create or update a character entry inside the specified story, storing personality/backstory.
     """
-    data = load_all_stories()
-    # If this story doesn't exist, create a default structure
-    if story_id not in data:
-        data[story_id] = {
-            "title": "",
-            "premise": "",
-            "genre": "",
-            "content": "",
-            "characters": {}
-        }
-    # If character doesn't exist yet, create a blank object
-    if name not in data[story_id]["characters"]:
-        data[story_id]["characters"][name] = {
-            "personality": "",
-            "backstory": "",
-            "first_appearance": "",
-            "last_appearance": ""
-        }
-    # Update personality/backstory
-    data[story_id]["characters"][name]["personality"] = personality
-    data[story_id]["characters"][name]["backstory"] = backstory
-    
-    save_all_stories(data)
+    get_store().update_character(story_id, name, personality=personality, backstory=backstory)
+
+
+def record_character_appearance(story_id: str, name: str, first_appearance: int = None, last_appearance: int = None) -> None:
+    """
+    Create or update a character entry, storing the character offsets (into the
+    story content) of its first and/or last mention. Offsets are stored as strings,
+    like the other character fields.
+    """
+    fields = {}
+    if first_appearance is not None:
+        fields["first_appearance"] = str(first_appearance)
+    if last_appearance is not None:
+        fields["last_appearance"] = str(last_appearance)
+    get_store().update_character(story_id, name, **fields)
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Usage: python modules/story_manager.py import [path/to/stories.json]
+    if len(sys.argv) >= 2 and sys.argv[1] == "import":
+        json_path = sys.argv[2] if len(sys.argv) > 2 else STORY_FILE
+        count = SqliteStoryStore().import_json(json_path)
+        print(f"Imported {count} stories from {json_path} into {STORY_DB}")
+    else:
+        print("Usage: python modules/story_manager.py import [path/to/stories.json]")